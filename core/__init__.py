@@ -1,7 +1,20 @@
 """核心模块 - 代码分析和学习工具"""
-
-from .code_indexer import CodeIndexer
-from .code_analyzer import CodeAnalyzer
-from .flowchart_generator import FlowchartGenerator
+from importlib import import_module
 
 __all__ = ["CodeIndexer", "CodeAnalyzer", "FlowchartGenerator"]
+
+# 按需导入：导入 core.config / core.logger 时不连带加载 tree-sitter 等重模块
+_LAZY_EXPORTS = {
+    "CodeIndexer": ".code_indexer",
+    "CodeAnalyzer": ".code_analyzer",
+    "FlowchartGenerator": ".flowchart_generator",
+}
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,128 @@
+"""解析结果缓存 - 按 (file_key, sha256) 持久化文件提取结果（SQLite）
+
+同时记录文件的 (mtime_ns, size)，文件未变化时无需读取内容即可命中。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from core.logger import get_logger
+from core.config import config
+
+logger = get_logger("ast_cache")
+
+# 提取逻辑变化导致结果不兼容时递增，旧缓存文件自动失效（打开缓存时删除）
+_CACHE_VERSION = 3
+
+# 每个进程只清理一次旧版本缓存文件
+_stale_cleaned = False
+
+
+class AstCache:
+    """单个仓库的解析结果缓存（连接在线程间共享，访问由锁串行化）"""
+
+    def __init__(self, db_path: Path, read_only: bool = False):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if read_only:
+            # 只读连接：不修改日志模式、不建表（由打开缓存的父进程负责）
+            self._conn = sqlite3.connect(
+                f"{Path(db_path).as_uri()}?mode=ro", uri=True, check_same_thread=False
+            )
+            return
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, sha BLOB NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, payload BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, file_key: str, sha: bytes) -> Optional[Dict[str, List[Any]]]:
+        """按内容哈希查询缓存，哈希不一致时视为未命中"""
+        return self._query("sha = ?", (file_key, sha))
+
+    def get_by_stat(self, file_key: str, mtime_ns: int, size: int) -> Optional[Dict[str, List[Any]]]:
+        """按文件 (mtime_ns, size) 查询缓存，文件未变化时无需读取内容"""
+        return self._query("mtime_ns = ? AND size = ?", (file_key, mtime_ns, size))
+
+    def _query(self, condition: str, params: Tuple[Any, ...]) -> Optional[Dict[str, List[Any]]]:
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    f"SELECT payload FROM entries WHERE key = ? AND {condition}", params
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"读取解析缓存失败 {params[0]}: {e}")
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put_many(
+        self, entries: Iterable[Tuple[str, bytes, int, int, Dict[str, List[Any]]]]
+    ) -> None:
+        """在一个事务中批量写入 (file_key, sha, mtime_ns, size, info)"""
+        try:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (key, sha, mtime_ns, size, payload) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (file_key, sha, mtime_ns, size, json.dumps(info, ensure_ascii=False))
+                        for file_key, sha, mtime_ns, size, info in entries
+                    ),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"写入解析缓存失败 {self.db_path}: {e}")
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _remove_stale_caches(cache_dir: Path) -> None:
+    """删除缓存目录中其他版本（index_v{N}_*）的缓存文件及其 -wal/-shm"""
+    current = f"index_v{_CACHE_VERSION}_"
+    for path in cache_dir.glob("index_v*_*.sqlite*"):
+        if path.name.startswith(current):
+            continue
+        try:
+            path.unlink()
+            logger.info(f"删除旧版本解析缓存: {path}")
+        except OSError as e:
+            logger.warning(f"删除旧版本解析缓存失败 {path}: {e}")
+
+
+def open_cache(repo_path: Path, read_only: bool = False) -> Optional[AstCache]:
+    """
+    打开仓库对应的缓存（位于 config.INDEX_CACHE_DIR，不写入被扫描的仓库）
+
+    Args:
+        repo_path: 仓库路径
+        read_only: 只读打开（进程池 worker 使用）；缓存文件不存在时返回 None，不创建目录和表
+
+    Returns:
+        AstCache 实例；未配置缓存目录或打开失败时返回 None
+    """
+    if not config.INDEX_CACHE_DIR:
+        return None
+
+    repo_id = hashlib.sha1(str(Path(repo_path).resolve()).encode("utf-8")).hexdigest()[:16]
+    db_path = Path(config.INDEX_CACHE_DIR) / f"index_v{_CACHE_VERSION}_{repo_id}.sqlite"
+    try:
+        if read_only:
+            return AstCache(db_path, read_only=True) if db_path.exists() else None
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        global _stale_cleaned
+        if not _stale_cleaned:
+            _stale_cleaned = True
+            _remove_stale_caches(db_path.parent)
+        return AstCache(db_path)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"打开解析缓存失败 {db_path}: {e}")
+        return None
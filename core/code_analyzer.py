@@ -1,14 +1,173 @@
 """代码分析器 - 分析代码流程和调用关系"""
+import ast
+import io
+import mmap
+import os
 import re
+import threading
+from functools import lru_cache, wraps
 from pathlib import Path
-from typing import Dict, List, Set, Optional, Any
-from collections import defaultdict, deque
+from typing import Dict, List, Set, Optional, Any, Tuple
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 from core.logger import get_logger
 from core.config import config
 
 logger = get_logger("code_analyzer")
 
+# Python 调用分析时过滤的关键字和内置函数
+_PYTHON_BUILTINS = frozenset({
+    'if', 'while', 'for', 'with', 'elif', 'except', 'assert',
+    'print', 'len', 'range', 'str', 'int', 'float', 'list', 'dict',
+    'set', 'tuple', 'bool', 'type', 'isinstance', 'hasattr', 'getattr',
+    'setattr', 'super', 'open', 'input', 'format', 'enumerate', 'zip',
+    'map', 'filter', 'sorted', 'reversed', 'min', 'max', 'sum', 'any', 'all'
+})
+
+# C/C++ 调用分析时过滤的关键字和宏
+_C_KEYWORDS = frozenset({
+    'if', 'while', 'for', 'switch', 'sizeof', 'return', 'typeof',
+    'else', 'case', 'default', 'break', 'continue', 'goto',
+    'NULL', 'true', 'false', 'nullptr'
+})
+
+# 通用调用分析时过滤的关键字
+_GENERIC_KEYWORDS = frozenset({'if', 'while', 'for', 'switch', 'return', 'function', 'class'})
+
+# 复杂度分析时统计的控制流关键字
+_CONTROL_KEYWORDS = frozenset({
+    'if', 'else', 'elif', 'while', 'for', 'switch', 'case', 'except', 'catch'
+})
+
+# 预编译的正则：函数调用 / 标识符（可选紧跟调用括号）
+# 使用占有量词（*+），标识符和空白匹配失败后不再回溯
+_CALL_RE = re.compile(r'\b([a-zA-Z_]\w*+)\s*+\(')
+_TOKEN_RE = re.compile(r'\b([a-zA-Z_]\w*+)(\s*+\()?')
+
+
+# 可能包含函数定义的 Python AST 节点（表达式内部不会出现 def）
+_PY_BLOCK_NODES = (ast.stmt, ast.excepthandler, ast.match_case)
+
+
+def _iter_function_defs(tree: ast.AST):
+    """
+    遍历 Python AST 中的函数定义
+    
+    与 ast.walk 的广度优先顺序一致，但只深入语句节点，跳过所有表达式子树
+    """
+    todo = deque([tree])
+    while todo:
+        node = todo.popleft()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            yield node
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, _PY_BLOCK_NODES):
+                todo.append(child)
+
+
+# 线程级复用的读缓冲区，小文件读入后直接解码，避免每次分配 bytes 对象
+_scratch = threading.local()
+
+
+def _scratch_buffer() -> bytearray:
+    """获取当前线程的读缓冲区（容量为 MMAP_MIN_BYTES）"""
+    buf = getattr(_scratch, "buf", None)
+    if buf is None:
+        buf = _scratch.buf = bytearray(config.MMAP_MIN_BYTES)
+    return buf
+
+
+def _read_text(file_path: Path) -> str:
+    """
+    读取源文件文本（UTF-8，忽略非法字节，换行统一为 '\\n'）
+    
+    小文件读入复用的缓冲区后解码；大文件通过 mmap 直接解码，
+    两者都省去了中间 bytes 对象的整份拷贝
+    """
+    with open(file_path, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        if size < config.MMAP_MIN_BYTES:
+            with memoryview(_scratch_buffer()) as view:
+                filled = 0
+                while filled < size:
+                    n = f.readinto(view[filled:size])
+                    if not n:
+                        break
+                    filled += n
+                text = str(view[:filled], 'utf-8', 'ignore')
+        else:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, 'utf-8', 'ignore')
+    
+    # 与文本模式 open() 的通用换行行为保持一致
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def _find_matching_brace(content: str, open_pos: int) -> int:
+    """
+    从 open_pos 处的 '{' 开始做括号匹配（基于 str.find，不逐字符遍历）
+    
+    注意：不识别字符串字面量和注释中的括号
+    
+    Returns:
+        匹配的 '}' 之后的位置，括号不平衡时返回 -1
+    """
+    depth = 1
+    pos = open_pos + 1
+    close = content.find('}', pos)
+    while close >= 0:
+        opening = content.find('{', pos, close)
+        if opening >= 0:
+            depth += 1
+            pos = opening + 1
+            continue
+        depth -= 1
+        pos = close + 1
+        if depth == 0:
+            return pos
+        close = content.find('}', pos)
+    return -1
+
+
+def _unwind_path(node: Optional[tuple]) -> List[str]:
+    """将 (函数名, 父节点, 长度) 链表还原为从起点开始的函数名列表"""
+    names = []
+    while node is not None:
+        names.append(node[0])
+        node = node[1]
+    names.reverse()
+    return names
+
+
+def _path_contains(node: Optional[tuple], name: str) -> bool:
+    """检查路径链表中是否已包含某个函数名"""
+    while node is not None:
+        if node[0] == name:
+            return True
+        node = node[1]
+    return False
+
+
+@lru_cache(maxsize=1024)
+def _c_function_def_re(function_name: str) -> "re.Pattern[str]":
+    """按函数名编译 C/C++ 函数定义正则（带缓存）"""
+    return re.compile(rf'\b{re.escape(function_name)}\s*\([^)]*\)\s*\{{')
+
+
+def _synchronized(method):
+    """在分析器的锁内执行方法（文件缓存、调用图等内部状态不是线程安全的）"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class CodeAnalyzer:
     """代码流程分析器"""
@@ -24,9 +183,89 @@ class CodeAnalyzer:
         self.indexer: CodeIndexer = indexer
         self.call_graph: Dict[str, List[str]] = defaultdict(list)
         self.analyzed_functions: Set[str] = set()
+        # 已构建调用图的文件（file_key），每个文件只解析一次
+        self._graph_files: Set[str] = set()
+        
+        # 文件缓存：path -> (mtime, 内容, Python AST)，LRU 淘汰
+        self._file_cache: "OrderedDict[Path, Tuple[float, str, Optional[ast.AST]]]" = OrderedDict()
+        # 单次追踪内的调用结果缓存：(file, function) -> 被调用函数列表
+        self._calls_cache: Dict[Tuple[str, str], List[str]] = {}
+        # 追踪/路径/概念分析结果缓存（索引在扫描后不变），LRU 淘汰
+        # 命中时返回同一对象，调用方须将结果视为只读
+        self._result_cache: "OrderedDict[Tuple[Any, ...], Any]" = OrderedDict()
+        # 分析可能在工作线程中执行（tool 层 asyncio.to_thread）：
+        # 访问文件缓存/调用图的公开方法（@_synchronized）和结果缓存都在此锁内执行，可重入
+        self._lock = threading.RLock()
         
         logger.debug("初始化 CodeAnalyzer")
     
+    def _load(self, file_path: Path) -> Optional[str]:
+        """
+        读取文件内容，按 (path, mtime) 缓存
+        
+        Args:
+            file_path: 文件路径
+        
+        Returns:
+            文件内容，读取失败时返回 None
+        """
+        try:
+            mtime = file_path.stat().st_mtime
+        except OSError as e:
+            logger.warning(f"读取文件失败 {file_path}: {e}")
+            return None
+        
+        cached = self._file_cache.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            self._file_cache.move_to_end(file_path)
+            return cached[1]
+        
+        try:
+            content = _read_text(file_path)
+        except Exception as e:
+            logger.warning(f"读取文件失败 {file_path}: {e}")
+            return None
+        
+        self._file_cache[file_path] = (mtime, content, None)
+        self._file_cache.move_to_end(file_path)
+        if len(self._file_cache) > config.ANALYZER_FILE_CACHE_SIZE:
+            self._file_cache.popitem(last=False)
+        return content
+    
+    def _load_ast(self, file_path: Path) -> Optional[ast.AST]:
+        """获取 Python 文件的 AST（解析结果随文件内容一起缓存）"""
+        content = self._load(file_path)
+        if content is None:
+            return None
+        
+        mtime, _, tree = self._file_cache[file_path]
+        if tree is None:
+            try:
+                tree = ast.parse(content)
+            except (SyntaxError, ValueError) as e:
+                logger.debug(f"Python 解析失败，跳过调用分析 {file_path}: {e}")
+                return None
+            self._file_cache[file_path] = (mtime, content, tree)
+        return tree
+    
+    def _cached_result(self, key: Tuple[Any, ...]) -> Optional[Any]:
+        """查询分析结果缓存，命中时刷新 LRU 顺序"""
+        with self._lock:
+            result = self._result_cache.get(key)
+            if result is not None:
+                try:
+                    self._result_cache.move_to_end(key)
+                except KeyError:
+                    pass
+            return result
+    
+    def _remember_result(self, key: Tuple[Any, ...], result: Any) -> None:
+        with self._lock:
+            self._result_cache[key] = result
+            if len(self._result_cache) > config.ANALYSIS_RESULT_CACHE_SIZE:
+                self._result_cache.popitem(last=False)
+    
+    @_synchronized
     def find_function_calls(self, file_path: Path, function_name: str) -> List[str]:
         """
         在指定文件中查找函数调用
@@ -38,125 +277,145 @@ class CodeAnalyzer:
         Returns:
             被调用的函数名列表
         """
+        file_key = self._file_key(file_path)
+        if file_key is not None:
+            self._ensure_call_graph(file_key)
+            calls = self.call_graph.get(f"{file_key}:{function_name}")
+            if calls is not None:
+                return calls
+        
+        # 未被索引的函数：回退到按需扫描
+        cache_key = (str(file_path), function_name)
+        calls = self._calls_cache.get(cache_key)
+        if calls is None:
+            calls = self._scan_function_calls(file_path, function_name)
+            self._calls_cache[cache_key] = calls
+        return calls
+    
+    def _file_key(self, file_path: Path) -> Optional[str]:
+        """将文件路径转换为索引中的 file_key，不在索引中时返回 None"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-        except Exception as e:
-            logger.warning(f"读取文件失败 {file_path}: {e}")
-            return []
+            file_key = str(file_path.relative_to(self.indexer.repo_path))
+        except ValueError:
+            return None
+        return file_key if file_key in self.indexer.functions else None
+    
+    def _ensure_call_graph(self, file_key: str) -> None:
+        """
+        为文件中所有已索引函数构建调用关系，写入 self.call_graph
+        
+        首次访问某个文件时整体解析一次，之后的查询直接查字典。
+        """
+        if file_key in self._graph_files:
+            return
+        self._graph_files.add(file_key)
         
+        file_path = self.indexer.repo_path / file_key
+        names = dict.fromkeys(f["name"] for f in self.indexer.functions.get(file_key, []))
+        suffix = file_path.suffix
+        
+        if suffix == '.py':
+            tree = self._load_ast(file_path)
+            if tree is None:
+                return
+            # 同名函数以广度优先遍历中第一个出现的定义为准
+            for node in _iter_function_defs(tree):
+                key = f"{file_key}:{node.name}"
+                if node.name in names and key not in self.call_graph:
+                    self.call_graph[key] = self._collect_python_calls(node)
+            return
+        
+        content = self._load(file_path)
+        if content is None:
+            return
+        
+        if suffix in ['.c', '.h', '.cpp', '.hpp']:
+            for name in names:
+                self.call_graph[f"{file_key}:{name}"] = self._find_c_function_calls(content, name)
+        else:
+            # 通用策略按整个文件提取调用，所有函数共享同一结果
+            calls = self._find_generic_function_calls(content, "")
+            for name in names:
+                self.call_graph[f"{file_key}:{name}"] = calls
+    
+    def _scan_function_calls(self, file_path: Path, function_name: str) -> List[str]:
+        """根据文件类型解析函数体，提取被调用的函数"""
         suffix = file_path.suffix
         
         # 根据文件类型选择不同的解析策略
         if suffix == '.py':
-            return self._find_python_function_calls(content, function_name)
-        elif suffix in ['.c', '.h', '.cpp', '.hpp']:
+            tree = self._load_ast(file_path)
+            if tree is None:
+                return []
+            return self._find_python_function_calls(tree, function_name)
+        
+        content = self._load(file_path)
+        if content is None:
+            return []
+        
+        if suffix in ['.c', '.h', '.cpp', '.hpp']:
             return self._find_c_function_calls(content, function_name)
         else:
             return self._find_generic_function_calls(content, function_name)
     
-    def _find_python_function_calls(self, content: str, function_name: str) -> List[str]:
-        """查找 Python 函数调用"""
+    def _find_python_function_calls(self, tree: ast.AST, function_name: str) -> List[str]:
+        """查找 Python 函数调用（基于 ast 解析，避免正则 + 缩进切片）"""
         # 找到函数定义
-        func_pattern = rf'def\s+{re.escape(function_name)}\s*\([^)]*\)\s*(?:->.*?)?:'
-        match = re.search(func_pattern, content)
-        
-        if not match:
+        target = next(
+            (node for node in _iter_function_defs(tree) if node.name == function_name),
+            None
+        )
+        if target is None:
             return []
         
-        # 提取函数体（基于缩进）
-        start = match.end()
-        lines = content[start:].split('\n')
-        
-        function_body_lines = []
-        base_indent = None
-        
-        for line in lines:
-            if not line.strip():  # 空行
-                function_body_lines.append(line)
-                continue
-            
-            # 计算缩进
-            stripped = line.lstrip()
-            if not stripped:
+        return self._collect_python_calls(target)
+    
+    def _collect_python_calls(self, target: ast.AST) -> List[str]:
+        """收集函数体内的调用：name(...) 与 obj.attr(...)（去重并保持出现顺序）"""
+        calls: Dict[str, None] = {}
+        for node in ast.walk(target):
+            if not isinstance(node, ast.Call):
                 continue
-                
-            current_indent = len(line) - len(stripped)
-            
-            if base_indent is None:
-                base_indent = current_indent
-            
-            if current_indent >= base_indent:
-                function_body_lines.append(line)
+            if isinstance(node.func, ast.Name):
+                name = node.func.id
+            elif isinstance(node.func, ast.Attribute):
+                name = node.func.attr
             else:
-                break
-        
-        function_body = '\n'.join(function_body_lines)
-        
-        # 查找函数调用
-        call_pattern = r'\b([a-zA-Z_]\w*)\s*\('
-        calls = re.findall(call_pattern, function_body)
-        
-        # 过滤关键字和内置函数
-        keywords = {
-            'if', 'while', 'for', 'with', 'elif', 'except', 'assert',
-            'print', 'len', 'range', 'str', 'int', 'float', 'list', 'dict',
-            'set', 'tuple', 'bool', 'type', 'isinstance', 'hasattr', 'getattr',
-            'setattr', 'super', 'open', 'input', 'format', 'enumerate', 'zip',
-            'map', 'filter', 'sorted', 'reversed', 'min', 'max', 'sum', 'any', 'all'
-        }
-        calls = [call for call in calls if call not in keywords]
+                continue
+            if name not in _PYTHON_BUILTINS:
+                calls[name] = None
         
-        return list(set(calls))
+        return list(calls)
     
     def _find_c_function_calls(self, content: str, function_name: str) -> List[str]:
         """查找 C/C++ 函数调用"""
         # 找到函数定义的位置
-        func_pattern = rf'\b{re.escape(function_name)}\s*\([^)]*\)\s*\{{'
-        match = re.search(func_pattern, content)
+        match = _c_function_def_re(function_name).search(content)
         
         if not match:
             return []
         
         # 提取函数体（括号匹配）
         start = match.end() - 1
-        brace_count = 1
-        end = start + 1
-        
-        while end < len(content) and brace_count > 0:
-            if content[end] == '{':
-                brace_count += 1
-            elif content[end] == '}':
-                brace_count -= 1
-            end += 1
-        
-        function_body = content[start:end]
-        
-        # 查找函数调用
-        call_pattern = r'\b([a-zA-Z_]\w*)\s*\('
-        calls = re.findall(call_pattern, function_body)
-        
-        # 过滤关键字和宏
-        keywords = {
-            'if', 'while', 'for', 'switch', 'sizeof', 'return', 'typeof',
-            'else', 'case', 'default', 'break', 'continue', 'goto',
-            'NULL', 'true', 'false', 'nullptr'
-        }
-        calls = [call for call in calls if call not in keywords]
-        
-        return list(set(calls))
+        end = _find_matching_brace(content, start)
+        if end < 0:
+            end = len(content)
+        
+        # 在函数体范围内查找函数调用，过滤关键字和宏（去重并保持出现顺序）
+        return list(dict.fromkeys(
+            call for call in _CALL_RE.findall(content, start, end)
+            if call not in _C_KEYWORDS
+        ))
     
     def _find_generic_function_calls(self, content: str, function_name: str) -> List[str]:
         """通用函数调用查找"""
-        # 简单的函数调用模式匹配
-        call_pattern = r'\b([a-zA-Z_]\w*)\s*\('
-        calls = re.findall(call_pattern, content)
-        
-        keywords = {'if', 'while', 'for', 'switch', 'return', 'function', 'class'}
-        calls = [call for call in calls if call not in keywords]
-        
-        return list(set(calls))
+        # 简单的函数调用模式匹配（去重并保持出现顺序）
+        return list(dict.fromkeys(
+            call for call in _CALL_RE.findall(content)
+            if call not in _GENERIC_KEYWORDS
+        ))
     
+    @_synchronized
     def trace_function_flow(
         self, 
         function_name: str, 
@@ -170,12 +429,19 @@ class CodeAnalyzer:
             max_depth: 最大追踪深度
         
         Returns:
-            函数调用树
+            函数调用树（可能来自结果缓存，与其他调用方共享，请勿修改）
         """
         if max_depth is None:
             max_depth = config.MAX_TRACE_DEPTH
         
+        cache_key = ("trace", function_name, max_depth)
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            logger.info(f"函数追踪命中缓存: {function_name}，深度: {max_depth}")
+            return cached
+        
         logger.info(f"开始追踪函数 '{function_name}'，最大深度: {max_depth}")
+        self._calls_cache.clear()
         
         # 查找函数定义
         functions = self.indexer.search_function(function_name)
@@ -197,59 +463,59 @@ class CodeAnalyzer:
             "call_tree": call_tree
         }
         
+        self._remember_result(cache_key, result)
         logger.info(f"函数追踪完成: {function_name}")
         return result
     
     def _build_call_tree(
         self, 
         func_info: Dict[str, Any], 
-        max_depth: int,
-        current_depth: int = 0, 
-        visited: Optional[Set[str]] = None
+        max_depth: int
     ) -> Dict[str, Any]:
-        """递归构建调用树"""
-        if visited is None:
-            visited = set()
-        
-        func_key = f"{func_info['file']}:{func_info['name']}"
-        
-        if current_depth >= max_depth or func_key in visited:
-            return {
-                "name": func_info["name"],
-                "file": func_info["file"],
-                "line": func_info["line"],
-                "calls": [],
-                "truncated": current_depth >= max_depth
-            }
-        
-        visited.add(func_key)
-        
-        # 获取文件路径
-        file_path = self.indexer.repo_path / func_info["file"]
-        
-        # 查找该函数调用的其他函数
-        called_functions = self.find_function_calls(file_path, func_info["name"])
-        
-        calls = []
-        for called_func in called_functions:
-            # 查找被调用函数的定义
-            called_func_infos = self.indexer.search_function(called_func)
-            if called_func_infos:
-                # 使用第一个匹配项
-                sub_tree = self._build_call_tree(
-                    called_func_infos[0],
-                    max_depth,
-                    current_depth + 1,
-                    visited.copy()
-                )
-                calls.append(sub_tree)
+        """
+        构建调用树（迭代 BFS，共享 visited 集合）
         
-        return {
+        每个函数只在最浅的位置展开一次，再次出现时作为叶子节点引用，
+        避免递归时逐层复制 visited 集合以及重复展开相同子树。
+        """
+        root = {
             "name": func_info["name"],
             "file": func_info["file"],
             "line": func_info["line"],
-            "calls": calls
+            "calls": []
         }
+        visited: Set[Tuple[str, str]] = set()
+        queue = deque([(root, func_info, 0)])
+        
+        while queue:
+            node, info, depth = queue.popleft()
+            func_key = (info["file"], info["name"])
+            
+            if depth >= max_depth or func_key in visited:
+                node["truncated"] = depth >= max_depth
+                continue
+            
+            visited.add(func_key)
+            
+            # 查找该函数调用的其他函数
+            file_path = self.indexer.repo_path / info["file"]
+            called_functions = self.find_function_calls(file_path, info["name"])
+            
+            for called_func in called_functions:
+                # 查找被调用函数的定义，使用第一个匹配项
+                called_func_infos = self.indexer.search_function(called_func)
+                if called_func_infos:
+                    called_info = called_func_infos[0]
+                    child = {
+                        "name": called_info["name"],
+                        "file": called_info["file"],
+                        "line": called_info["line"],
+                        "calls": []
+                    }
+                    node["calls"].append(child)
+                    queue.append((child, called_info, depth + 1))
+        
+        return root
     
     def analyze_concept(
         self, 
@@ -264,8 +530,15 @@ class CodeAnalyzer:
             keywords: 相关关键字列表（如 ["malloc", "alloc", "kmalloc"]）
         
         Returns:
-            分析结果
+            分析结果（可能来自结果缓存，与其他调用方共享，请勿修改）
         """
+        # 关键词顺序决定结果顺序，按元组作为缓存键
+        cache_key = ("concept", concept, tuple(keywords))
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            logger.info(f"概念分析命中缓存: '{concept}'")
+            return cached
+        
         logger.info(f"开始分析概念 '{concept}'，关键词: {keywords}")
         
         # 搜索相关函数
@@ -281,32 +554,42 @@ class CodeAnalyzer:
             if key not in unique_functions:
                 unique_functions[key] = func
         
-        # 分析每个函数
+        # 分析每个函数（读取代码片段是 I/O 密集操作，用线程池并发）
+        funcs = list(unique_functions.values())
+        if len(funcs) > 1:
+            workers = min(config.MAX_IO_WORKERS, len(funcs))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                function_results = list(executor.map(self._snippet_for, funcs))
+        else:
+            function_results = [self._snippet_for(func) for func in funcs]
+        
         analysis = {
             "concept": concept,
             "keywords": keywords,
             "total_functions": len(unique_functions),
-            "functions": []
+            "functions": function_results
         }
         
-        for func_key, func in unique_functions.items():
-            # 获取函数的代码片段
-            code_snippet = self.indexer.get_file_content(
-                func["file"],
-                max(1, func["line"] - 2),
-                func["line"] + 10
-            )
-            
-            analysis["functions"].append({
-                "name": func["name"],
-                "file": func["file"],
-                "line": func["line"],
-                "snippet": code_snippet[:config.MAX_SNIPPET_LENGTH]
-            })
-        
+        self._remember_result(cache_key, analysis)
         logger.info(f"概念分析完成: 找到 {len(unique_functions)} 个相关函数")
         return analysis
     
+    def _snippet_for(self, func: Dict[str, Any]) -> Dict[str, Any]:
+        """获取函数的代码片段，生成概念分析条目"""
+        code_snippet = self.indexer.get_file_content(
+            func["file"],
+            max(1, func["line"] - 2),
+            func["line"] + 10
+        )
+        
+        return {
+            "name": func["name"],
+            "file": func["file"],
+            "line": func["line"],
+            "snippet": code_snippet[:config.MAX_SNIPPET_LENGTH]
+        }
+    
+    @_synchronized
     def find_call_path(
         self, 
         from_func: str, 
@@ -322,9 +605,16 @@ class CodeAnalyzer:
             max_depth: 最大搜索深度
         
         Returns:
-            所有可能的调用路径列表
+            调用路径列表（每个起点只保留长度最短的路径；可能来自结果缓存，请勿修改）
         """
+        cache_key = ("path", from_func, to_func, max_depth)
+        cached = self._cached_result(cache_key)
+        if cached is not None:
+            logger.info(f"调用路径命中缓存: {from_func} -> {to_func}")
+            return cached
+        
         logger.info(f"查找调用路径: {from_func} -> {to_func}")
+        self._calls_cache.clear()
         
         from_functions = self.indexer.search_function(from_func)
         to_functions = self.indexer.search_function(to_func)
@@ -335,19 +625,27 @@ class CodeAnalyzer:
         
         paths = []
         to_func_names = {f["name"] for f in to_functions}
+        # 同一次查询内复用函数名 -> 定义列表的查找结果
+        lookup_cache: Dict[str, List[Dict[str, Any]]] = {}
         
         for start_func in from_functions:
-            # BFS 队列：(当前函数信息, 路径)
-            queue = deque([(start_func, [start_func["name"]])])
+            # BFS 队列：(当前函数信息, 路径节点)
+            # 路径节点为 (函数名, 父节点, 长度) 的链表，扩展时不再复制整条路径
+            queue = deque([(start_func, (start_func["name"], None, 1))])
             visited = set()
+            # 已找到的最短路径长度；BFS 按长度递增出队，更长的路径无需继续展开
+            best_len = None
             
             while queue:
-                current_func, path = queue.popleft()
+                current_func, path_node = queue.popleft()
+                path_len = path_node[2]
                 
-                if len(path) > max_depth:
+                if best_len is not None and path_len >= best_len:
+                    break
+                if path_len > max_depth:
                     continue
                 
-                func_key = f"{current_func['file']}:{current_func['name']}"
+                func_key = (current_func["file"], current_func["name"])
                 if func_key in visited:
                     continue
                 visited.add(func_key)
@@ -357,21 +655,31 @@ class CodeAnalyzer:
                 called_functions = self.find_function_calls(file_path, current_func["name"])
                 
                 for called_func_name in called_functions:
-                    # 检查是否到达目标
+                    # 检查是否到达目标（只在命中时还原完整路径）
                     if called_func_name in to_func_names:
-                        paths.append(path + [called_func_name])
+                        paths.append(_unwind_path(path_node) + [called_func_name])
+                        best_len = path_len + 1
+                        continue
+                    
+                    # 避免循环
+                    if _path_contains(path_node, called_func_name):
                         continue
                     
                     # 继续搜索
-                    called_func_infos = self.indexer.search_function(called_func_name)
+                    called_func_infos = lookup_cache.get(called_func_name)
+                    if called_func_infos is None:
+                        called_func_infos = self.indexer.search_function(called_func_name)
+                        lookup_cache[called_func_name] = called_func_infos
+                    
+                    new_node = (called_func_name, path_node, path_len + 1)
                     for called_func_info in called_func_infos:
-                        new_path = path + [called_func_name]
-                        if called_func_name not in path:  # 避免循环
-                            queue.append((called_func_info, new_path))
+                        queue.append((called_func_info, new_node))
         
+        self._remember_result(cache_key, paths)
         logger.info(f"找到 {len(paths)} 条调用路径")
         return paths
     
+    @_synchronized
     def extract_function_code(self, function_name: str) -> Optional[Dict[str, Any]]:
         """
         提取完整的函数代码
@@ -390,9 +698,16 @@ class CodeAnalyzer:
         func_info = functions[0]
         file_path = self.indexer.repo_path / func_info["file"]
         
+        content = self._load(file_path)
+        if content is None:
+            return {
+                "error": "读取文件失败",
+                "name": func_info["name"],
+                "file": func_info["file"]
+            }
+        
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
+            lines = io.StringIO(content).readlines()
             
             start_line = func_info["line"] - 1
             end_line = func_info.get("end_line", start_line + 50)
@@ -403,22 +718,12 @@ class CodeAnalyzer:
             else:
                 # 否则尝试通过括号匹配找到结束位置
                 end_line = start_line
-                brace_count = 0
-                found_start = False
-                
-                for i in range(start_line, min(len(lines), start_line + 200)):
-                    line = lines[i]
-                    for char in line:
-                        if char == '{':
-                            brace_count += 1
-                            found_start = True
-                        elif char == '}':
-                            brace_count -= 1
-                            if found_start and brace_count == 0:
-                                end_line = i
-                                break
-                    if found_start and brace_count == 0:
-                        break
+                window = ''.join(lines[start_line:start_line + 200])
+                open_pos = window.find('{')
+                if open_pos >= 0:
+                    close_end = _find_matching_brace(window, open_pos)
+                    if close_end >= 0:
+                        end_line = start_line + window.count('\n', 0, close_end - 1)
                 
                 code = ''.join(lines[start_line:end_line + 1])
             
@@ -437,6 +742,7 @@ class CodeAnalyzer:
                 "file": func_info["file"]
             }
     
+    @_synchronized
     def get_function_complexity(self, function_name: str) -> Dict[str, Any]:
         """
         分析函数复杂度
@@ -457,15 +763,20 @@ class CodeAnalyzer:
         # 计算各种指标
         lines = code.split('\n')
         total_lines = len(lines)
-        code_lines = len([l for l in lines if l.strip() and not l.strip().startswith(('//', '#', '*'))])
-        
-        # 控制流语句数量（圈复杂度近似）
-        control_keywords = ['if', 'else', 'elif', 'while', 'for', 'switch', 'case', 'except', 'catch']
-        control_count = sum(len(re.findall(rf'\b{kw}\b', code)) for kw in control_keywords)
-        
-        # 函数调用数量
-        call_pattern = r'\b([a-zA-Z_]\w*)\s*\('
-        calls = len(re.findall(call_pattern, code))
+        code_lines = 0
+        for line in lines:
+            stripped = line.strip()
+            if stripped and not stripped.startswith(('//', '#', '*')):
+                code_lines += 1
+        
+        # 一次扫描同时统计控制流语句数量（圈复杂度近似）和函数调用数量
+        control_count = 0
+        calls = 0
+        for name, call_paren in _TOKEN_RE.findall(code):
+            if name in _CONTROL_KEYWORDS:
+                control_count += 1
+            if call_paren:
+                calls += 1
         
         # 圈复杂度 = 1 + 控制流数量
         cyclomatic_complexity = 1 + control_count
@@ -1,21 +1,166 @@
 """代码索引器 - 使用 tree-sitter 扫描和索引代码库"""
 import os
+import bisect
 import fnmatch
+import hashlib
+import multiprocessing
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple, Union
 
 import tree_sitter_python as tspython
 import tree_sitter_c as tsc
-from tree_sitter import Language, Parser, Node
+from tree_sitter import Language, Parser, Node, Query, QueryCursor
 
 from core.logger import get_logger
 from core.config import config
+from core.ast_cache import AstCache, open_cache
 
 logger = get_logger("code_indexer")
 
+# 需要写回解析缓存的文件状态：(sha256, mtime_ns, size)
+CacheEntry = Tuple[bytes, int, int]
+# 待写回的缓存条目：(file_key, sha256, mtime_ns, size, info)
+PendingCacheEntry = Tuple[str, bytes, int, int, Dict[str, List[Any]]]
+# 单个文件的解析结果：(file_path, (file_key, info, cache_entry) 或 None, 错误信息)
+ParseOutcome = Tuple[str, Optional[Tuple[str, Dict[str, List[Any]], Optional[CacheEntry]]], Optional[str]]
+
+
+# 语言对象在模块导入时创建一次，所有解析器实例与线程共享（子进程导入时各自创建一次）
+_PY_LANGUAGE = Language(tspython.language())
+_C_LANGUAGE = Language(tsc.language())
+
+# tree-sitter 查询：在 C 中完成遍历，只把命中的节点交回 Python
+_PY_QUERY = """
+(function_definition name: (identifier) @name parameters: (parameters) @params) @function
+(class_definition name: (identifier) @name) @class
+[(import_statement) (import_from_statement)] @import
+"""
+
+_C_QUERY = """
+(function_definition declarator: (_) @declarator) @function
+(struct_specifier name: (_) @name) @struct
+(preproc_include path: (_) @path)
+"""
+
+# 正则回退的预编译模式：(函数模式, 结构体/类模式, 依赖模式)
+_JS_PATTERNS = (
+    (
+        re.compile(r'function\s+(\w+)\s*\(([^)]*)\)'),  # function name()
+        re.compile(r'(?:const|let|var)\s+(\w+)\s*=\s*(?:async\s*)?\([^)]*\)\s*=>'),  # arrow function
+        # \b：只从单词开头尝试，避免在压缩代码的超长标识符里逐字符回溯
+        re.compile(r'\b(\w++)\s*:\s*(?:async\s*)?function\s*\(([^)]*)\)'),  # method: function()
+    ),
+    (re.compile(r'class\s+(\w+)'),),
+    # import 子句不跨越引号、分号和换行，避免每个 import 都扫描到行尾
+    (re.compile(r'import\s+[^\'";\n]*?from\s+[\'"]([^\'"]+)[\'"]'),),
+)
+
+_GO_PATTERNS = (
+    (re.compile(r'func\s+(?:\([^)]+\)\s+)?(\w+)\s*\(([^)]*)\)'),),
+    (re.compile(r'type\s+(\w+)\s+struct'),),
+    (),
+)
+
+_JAVA_PATTERNS = (
+    (re.compile(
+        r'(?:public|private|protected)?\s*(?:static)?\s*\w+\s+(\w+)\s*\(([^)]*)\)'
+        r'\s*(?:throws\s+\w+(?:,\s*\w+)*)?\s*\{'
+    ),),
+    (re.compile(r'(?:public|private)?\s*class\s+(\w+)'),),
+    (),
+)
+
+_REGEX_PATTERNS = {".js": _JS_PATTERNS, ".ts": _JS_PATTERNS, ".go": _GO_PATTERNS, ".java": _JAVA_PATTERNS}
+
+
+def _newline_offsets(content: str) -> List[int]:
+    """返回内容中所有换行符的位置（升序），用于二分查找行号"""
+    offsets = []
+    pos = content.find('\n')
+    while pos >= 0:
+        offsets.append(pos)
+        pos = content.find('\n', pos + 1)
+    return offsets
+
+
+@lru_cache(maxsize=8)
+def _compile_ignore_re(patterns: Tuple[str, ...]) -> "re.Pattern[str]":
+    """把忽略模式合并为一个预编译正则（按模式组合缓存，会话间复用）"""
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns) or r"(?!)")
+
+
+def _decode_source(raw: bytes) -> str:
+    """解码源文件（UTF-8，忽略非法字节），换行与文本模式 open() 一致地统一为 '\\n'"""
+    content = raw.decode('utf-8', errors='ignore')
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
+
+
+def _node_text(source: bytes, node: Node) -> str:
+    """按字节偏移截取节点源码并解码"""
+    return _decode_source(source[node.start_byte:node.end_byte])
+
+
+class _NameIndex:
+    """
+    名称子串索引：所有小写名称用 NUL 拼接成一个字符串，子串匹配交给 str.find
+    
+    结果按记录在索引中的原始顺序（文件顺序、文件内顺序）返回。
+    """
+    _SEP = "\0"
+
+    def __init__(self, records_by_file: Dict[str, List[Dict[str, Any]]]):
+        self._records: List[Dict[str, Any]] = []
+        ids_by_name: Dict[str, List[int]] = {}
+        for records in records_by_file.values():
+            for record in records:
+                ids_by_name.setdefault(record["name"].lower(), []).append(len(self._records))
+                self._records.append(record)
+
+        self._ids = list(ids_by_name.values())
+        self._starts: List[int] = []
+        pos = 0
+        for name in ids_by_name:
+            self._starts.append(pos)
+            pos += len(name) + 1
+        self._blob = self._SEP.join(ids_by_name)
+
+    def search(self, keyword_lower: str) -> List[Dict[str, Any]]:
+        """返回小写名称包含 keyword_lower 的所有记录"""
+        if not keyword_lower:
+            return list(self._records)
+        if self._SEP in keyword_lower:
+            return [r for r in self._records if keyword_lower in r["name"].lower()]
+
+        hits: List[int] = []
+        starts = self._starts
+        pos = self._blob.find(keyword_lower)
+        while pos >= 0:
+            i = bisect.bisect_right(starts, pos) - 1
+            hits.extend(self._ids[i])
+            # 同一名称只计一次，从下一个名称开始继续查找
+            if i + 1 >= len(starts):
+                break
+            pos = self._blob.find(keyword_lower, starts[i + 1])
+
+        hits.sort()
+        return [self._records[i] for i in hits]
+
 
 class TreeSitterParser:
-    """Tree-sitter 解析器封装（进程级单例，避免重复初始化）。"""
+    """
+    Tree-sitter 解析器封装（进程级单例，避免重复初始化）。
+
+    Language 和预编译查询在线程间共享；Parser 不是线程安全的，每个线程各自持有。
+    """
 
     _shared: "TreeSitterParser" = None
 
@@ -27,70 +172,118 @@ class TreeSitterParser:
         return cls._shared
 
     def __init__(self):
-        self._parsers: Dict[str, Parser] = {}
+        self._languages: Dict[str, Language] = {}
+        self._queries: Dict[str, Query] = {}
+        self._local = threading.local()
         self._init_parsers()
 
     def _init_parsers(self):
-        """初始化各语言的解析器"""
-        # Python 解析器
-        py_parser = Parser(Language(tspython.language()))
-        self._parsers[".py"] = py_parser
+        """按扩展名登记语言及其预编译查询"""
+        # Python
+        py_query = Query(_PY_LANGUAGE, _PY_QUERY)
+        self._languages[".py"] = _PY_LANGUAGE
+        self._queries[".py"] = py_query
 
-        # C/C++ 解析器
-        c_parser = Parser(Language(tsc.language()))
-        self._parsers[".c"] = c_parser
-        self._parsers[".h"] = c_parser
-        self._parsers[".cpp"] = c_parser
-        self._parsers[".hpp"] = c_parser
+        # C/C++
+        c_query = Query(_C_LANGUAGE, _C_QUERY)
+        for ext in (".c", ".h", ".cpp", ".hpp"):
+            self._languages[ext] = _C_LANGUAGE
+            self._queries[ext] = c_query
 
-        logger.debug(f"初始化了 {len(self._parsers)} 个语言解析器")
+        logger.debug(f"初始化了 {len(self._languages)} 个扩展名的语言")
 
     def get_parser(self, file_extension: str) -> Optional[Parser]:
-        """获取指定扩展名的解析器"""
-        return self._parsers.get(file_extension)
+        """获取当前线程中指定扩展名的解析器"""
+        language = self._languages.get(file_extension)
+        if language is None:
+            return None
+
+        parsers = getattr(self._local, "parsers", None)
+        if parsers is None:
+            parsers = self._local.parsers = {}
+        parser = parsers.get(file_extension)
+        if parser is None:
+            parser = parsers[file_extension] = Parser(language)
+        return parser
 
-    def parse(self, content: str, file_extension: str) -> Optional[Node]:
-        """解析代码内容，返回 AST 根节点"""
+    def parse(self, source: bytes, file_extension: str) -> Optional[Node]:
+        """解析源文件原始字节，返回 AST 根节点"""
         parser = self.get_parser(file_extension)
         if not parser:
             return None
 
-        tree = parser.parse(bytes(content, "utf-8"))
+        tree = parser.parse(source)
         return tree.root_node
 
+    def matches(self, root_node: Node, file_extension: str) -> List[Dict[str, List[Node]]]:
+        """
+        用预编译查询匹配 AST，返回每个匹配的 {捕获名: 节点列表}
+        
+        结果按匹配节点的起始位置排序，与先序遍历的顺序一致
+        """
+        query = self._queries.get(file_extension)
+        if query is None:
+            return []
+        
+        captures = [match for _, match in QueryCursor(query).matches(root_node)]
+        captures.sort(key=lambda match: min(
+            nodes[0].start_byte for nodes in match.values()
+        ))
+        return captures
+
     def supports(self, file_extension: str) -> bool:
         """检查是否支持该文件扩展名"""
-        return file_extension in self._parsers
+        return file_extension in self._languages
 
 
 class CodeIndexer:
     """代码库索引器，用于扫描和索引代码文件"""
     
-    def __init__(self, repo_path: str):
+    def __init__(self, repo_path: str, read_only_cache: bool = False):
         self.repo_path = Path(repo_path)
-        self.files: List[Path] = []
+        # 只读打开持久化缓存（进程池 worker 只查询，结果由父进程写回）
+        self._cache_read_only = read_only_cache
+        # 仓库路径前缀（以分隔符结尾），扫描得到的路径直接切片得到相对路径
+        self._repo_prefix = os.path.join(str(self.repo_path), "")
+        self.files: List[str] = []
         self.functions: Dict[str, List[Dict[str, Any]]] = {}
         self.structs: Dict[str, List[Dict[str, Any]]] = {}
         self.includes: Dict[str, List[str]] = {}
+        # 函数、结构体/类总数，随索引增量维护，避免每次统计都遍历全部文件
+        self.function_count = 0
+        self.struct_count = 0
         
         # 使用配置中的忽略模式
         self.ignore_patterns = config.get_ignore_patterns()
+        # 所有忽略模式合并为一个预编译正则，避免每次匹配都重新翻译 glob
+        self._ignore_re = _compile_ignore_re(self.ignore_patterns)
         
         # Tree-sitter 解析器（复用单例，减少资源占用）
         self._ts_parser = TreeSitterParser.shared()
         
+        # 持久化解析缓存（首次索引时打开）
+        self._cache: Optional[AstCache] = None
+        self._cache_opened = False
+        
+        # 名称搜索索引（首次搜索时构建，索引内容变化后失效）
+        self._function_index: Optional[_NameIndex] = None
+        self._struct_index: Optional[_NameIndex] = None
+        
+        # 文件内容缓存：file_key -> ((mtime_ns, size), 行列表)，按文件大小总量 LRU 淘汰
+        self._content_cache: "OrderedDict[str, Tuple[Tuple[int, int], List[str]]]" = OrderedDict()
+        self._content_cache_bytes = 0
+        self._content_lock = threading.Lock()
+        
         logger.info(f"初始化 CodeIndexer，仓库路径: {self.repo_path}")
     
     def should_ignore(self, path: Path) -> bool:
-        """检查路径是否应该被忽略"""
-        for pattern in self.ignore_patterns:
-            if fnmatch.fnmatch(path.name, pattern):
-                return True
-            # 检查父目录
-            for parent in path.parents:
-                if fnmatch.fnmatch(parent.name, pattern):
-                    return True
-        return False
+        """
+        检查路径是否应该被忽略
+
+        只匹配路径本身的名称：被忽略的目录在 scan_repository 遍历时已被剪枝，
+        无需再逐级检查父目录。
+        """
+        return self._ignore_re.match(path.name) is not None
     
     def scan_repository(self, extensions: Optional[List[str]] = None) -> Dict[str, Any]:
         """
@@ -113,76 +306,81 @@ class CodeIndexer:
         
         logger.info(f"开始扫描仓库: {self.repo_path}")
         logger.debug(f"扫描扩展名: {extensions}")
+        extension_set = frozenset(extensions)
         
-        # 递归扫描所有文件
-        for root, dirs, files in os.walk(self.repo_path):
-            # 过滤要忽略的目录
-            dirs[:] = [d for d in dirs if not self.should_ignore(Path(root) / d)]
+        # 基于 os.scandir 的显式栈遍历，顺序与 os.walk 自顶向下一致：
+        # 先收集当前目录的文件，再按目录项顺序深入子目录（不跟随目录符号链接）
+        ignore_match = self._ignore_re.match
+        stack = [str(self.repo_path)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    entries = list(it)
+            except OSError:
+                continue
             
-            for file in files:
-                file_path = Path(root) / file
-                if not self.should_ignore(file_path) and file_path.suffix in extensions:
-                    self.files.append(file_path)
-        
+            subdirs = []
+            for entry in entries:
+                name = entry.name
+                if ignore_match(name):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                elif os.path.splitext(name)[1] in extension_set:
+                    self.files.append(entry.path)
+            stack.extend(reversed(subdirs))
+        
+        suffix_counts = Counter(os.path.splitext(f)[1] for f in self.files)
         result = {
             "total_files": len(self.files),
             "extensions": {
-                ext: len([f for f in self.files if f.suffix == ext])
-                for ext in extensions if any(f.suffix == ext for f in self.files)
+                ext: suffix_counts[ext] for ext in extensions if suffix_counts[ext]
             }
         }
         
         logger.info(f"扫描完成，共 {result['total_files']} 个文件")
         return result
     
-    def _extract_python_info(self, root_node: Node, content: str, file_key: str) -> Dict[str, Any]:
+    def _extract_python_info(self, root_node: Node, source: bytes, file_key: str) -> Dict[str, Any]:
         """从 Python AST 提取函数和类信息"""
         functions = []
         classes = []
         imports = []
         
-        def visit_node(node: Node):
-            if node.type == 'function_definition':
+        for match in self._ts_parser.matches(root_node, '.py'):
+            if "function" in match:
                 # 提取函数信息
-                name_node = node.child_by_field_name('name')
-                params_node = node.child_by_field_name('parameters')
-                
-                if name_node:
-                    func_name = content[name_node.start_byte:name_node.end_byte]
-                    params = ""
-                    if params_node:
-                        params = content[params_node.start_byte:params_node.end_byte]
-                    
-                    functions.append({
-                        "name": func_name,
-                        "parameters": params,
-                        "line": node.start_point[0] + 1,
-                        "end_line": node.end_point[0] + 1,
-                        "file": file_key
-                    })
+                node = match["function"][0]
+                name_node = match["name"][0]
+                params_node = match["params"][0]
+                functions.append({
+                    "name": _node_text(source, name_node),
+                    "parameters": _node_text(source, params_node),
+                    "line": node.start_point[0] + 1,
+                    "end_line": node.end_point[0] + 1,
+                    "file": file_key
+                })
             
-            elif node.type == 'class_definition':
+            elif "class" in match:
                 # 提取类信息
-                name_node = node.child_by_field_name('name')
-                if name_node:
-                    class_name = content[name_node.start_byte:name_node.end_byte]
-                    classes.append({
-                        "name": class_name,
-                        "line": node.start_point[0] + 1,
-                        "end_line": node.end_point[0] + 1,
-                        "file": file_key
-                    })
+                node = match["class"][0]
+                name_node = match["name"][0]
+                classes.append({
+                    "name": _node_text(source, name_node),
+                    "line": node.start_point[0] + 1,
+                    "end_line": node.end_point[0] + 1,
+                    "file": file_key
+                })
             
-            elif node.type in ('import_statement', 'import_from_statement'):
+            else:
                 # 提取导入语句
-                import_text = content[node.start_byte:node.end_byte]
-                imports.append(import_text)
-            
-            # 递归访问子节点
-            for child in node.children:
-                visit_node(child)
-        
-        visit_node(root_node)
+                node = match["import"][0]
+                imports.append(_node_text(source, node))
         
         return {
             "functions": functions,
@@ -190,63 +388,52 @@ class CodeIndexer:
             "imports": imports
         }
     
-    def _extract_c_info(self, root_node: Node, content: str, file_key: str) -> Dict[str, Any]:
+    def _extract_c_info(self, root_node: Node, source: bytes, file_key: str) -> Dict[str, Any]:
         """从 C/C++ AST 提取函数和结构体信息"""
         functions = []
         structs = []
         includes = []
         
-        def visit_node(node: Node):
-            if node.type == 'function_definition':
+        for match in self._ts_parser.matches(root_node, '.c'):
+            if "function" in match:
                 # 提取函数信息
-                declarator = node.child_by_field_name('declarator')
-                if declarator:
-                    # 找到函数名
-                    func_name = self._find_function_name(declarator, content)
-                    if func_name:
-                        # 获取返回类型
-                        type_node = node.child_by_field_name('type')
-                        return_type = ""
-                        if type_node:
-                            return_type = content[type_node.start_byte:type_node.end_byte]
-                        
-                        # 获取参数
-                        params = self._find_parameters(declarator, content)
-                        
-                        functions.append({
-                            "name": func_name,
-                            "return_type": return_type,
-                            "parameters": params,
-                            "line": node.start_point[0] + 1,
-                            "end_line": node.end_point[0] + 1,
-                            "file": file_key
-                        })
-            
-            elif node.type == 'struct_specifier':
-                # 提取结构体信息
-                name_node = node.child_by_field_name('name')
-                if name_node:
-                    struct_name = content[name_node.start_byte:name_node.end_byte]
-                    structs.append({
-                        "name": struct_name,
+                node = match["function"][0]
+                declarator = match["declarator"][0]
+                func_name = self._find_function_name(declarator, source)
+                if func_name:
+                    # 获取返回类型
+                    type_node = node.child_by_field_name('type')
+                    return_type = ""
+                    if type_node:
+                        return_type = _node_text(source, type_node)
+                    
+                    # 获取参数
+                    params = self._find_parameters(declarator, source)
+                    
+                    functions.append({
+                        "name": func_name,
+                        "return_type": return_type,
+                        "parameters": params,
                         "line": node.start_point[0] + 1,
+                        "end_line": node.end_point[0] + 1,
                         "file": file_key
                     })
             
-            elif node.type == 'preproc_include':
-                # 提取 include 语句
-                path_node = node.child_by_field_name('path')
-                if path_node:
-                    include_path = content[path_node.start_byte:path_node.end_byte]
-                    # 移除引号或尖括号
-                    include_path = include_path.strip('"<>')
-                    includes.append(include_path)
+            elif "struct" in match:
+                # 提取结构体信息
+                node = match["struct"][0]
+                name_node = match["name"][0]
+                structs.append({
+                    "name": _node_text(source, name_node),
+                    "line": node.start_point[0] + 1,
+                    "file": file_key
+                })
             
-            # 递归访问子节点
-            for child in node.children:
-                visit_node(child)
-        
-        visit_node(root_node)
+            else:
+                # 提取 include 语句，移除引号或尖括号
+                path_node = match["path"][0]
+                include_path = _node_text(source, path_node)
+                includes.append(include_path.strip('"<>'))
         
         return {
             "functions": functions,
@@ -254,178 +441,207 @@ class CodeIndexer:
             "includes": includes
         }
     
-    def _find_function_name(self, declarator: Node, content: str) -> Optional[str]:
-        """从声明器中提取函数名"""
-        if declarator.type == 'identifier':
-            return content[declarator.start_byte:declarator.end_byte]
-        
-        if declarator.type == 'function_declarator':
-            inner = declarator.child_by_field_name('declarator')
-            if inner:
-                return self._find_function_name(inner, content)
-        
-        if declarator.type == 'pointer_declarator':
-            inner = declarator.child_by_field_name('declarator')
-            if inner:
-                return self._find_function_name(inner, content)
-        
-        # 遍历子节点查找
-        for child in declarator.children:
-            if child.type == 'identifier':
-                return content[child.start_byte:child.end_byte]
-            result = self._find_function_name(child, content)
-            if result:
-                return result
+    def _find_function_name(self, declarator: Node, source: bytes) -> Optional[str]:
+        """
+        从声明器中提取函数名
+        
+        显式栈做先序遍历，返回遇到的第一个标识符；函数/指针声明器只深入其
+        declarator 字段
+        """
+        stack = [declarator]
+        while stack:
+            node = stack.pop()
+            node_type = node.type
+            if node_type == 'identifier':
+                return _node_text(source, node)
+            
+            if node_type == 'function_declarator' or node_type == 'pointer_declarator':
+                inner = node.child_by_field_name('declarator')
+                if inner:
+                    stack.append(inner)
+                    continue
+            
+            stack.extend(reversed(node.children))
         
         return None
     
-    def _find_parameters(self, declarator: Node, content: str) -> str:
-        """从声明器中提取参数列表"""
-        if declarator.type == 'function_declarator':
-            params_node = declarator.child_by_field_name('parameters')
-            if params_node:
-                return content[params_node.start_byte:params_node.end_byte]
-        
-        for child in declarator.children:
-            result = self._find_parameters(child, content)
-            if result:
-                return result
+    def _find_parameters(self, declarator: Node, source: bytes) -> str:
+        """从声明器中提取参数列表（显式栈先序遍历，取第一个函数声明器的参数）"""
+        stack = [declarator]
+        while stack:
+            node = stack.pop()
+            if node.type == 'function_declarator':
+                params_node = node.child_by_field_name('parameters')
+                if params_node:
+                    return _node_text(source, params_node)
+            stack.extend(reversed(node.children))
         
         return ""
     
-    def index_file(self, file_path: Path) -> Dict[str, Any]:
+    def index_file(self, file_path: Union[str, Path]) -> Dict[str, Any]:
         """索引单个文件"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-        except Exception as e:
+            parsed = self._parse_file(file_path)
+        except OSError as e:
             logger.error(f"读取文件失败 {file_path}: {e}")
             return {"error": str(e)}
         
-        file_key = str(file_path.relative_to(self.repo_path))
-        suffix = file_path.suffix
+        file_key, info, cache_entry = parsed
+        self._store_file_info(file_key, info)
+        if cache_entry is not None:
+            self._cache.put_many([(file_key, *cache_entry, info)])
         
-        # 检查是否支持 tree-sitter 解析
+        if os.path.splitext(file_path)[1] == '.py' and self._ts_parser.supports('.py'):
+            return {
+                "functions": len(info["functions"]),
+                "classes": len(info["structs"]),
+                "imports": len(info["includes"])
+            }
+        return {
+            "functions": len(info["functions"]),
+            "structs": len(info["structs"]),
+            "includes": len(info["includes"])
+        }
+    
+    def _get_cache(self) -> Optional[AstCache]:
+        """获取持久化解析缓存（懒打开，未启用时返回 None）"""
+        if not self._cache_opened:
+            self._cache_opened = True
+            self._cache = open_cache(self.repo_path, read_only=self._cache_read_only)
+        return self._cache
+    
+    def _file_key(self, file_path: Union[str, Path]) -> str:
+        """文件在仓库内的相对路径（索引键）"""
+        path = os.fspath(file_path)
+        if path.startswith(self._repo_prefix):
+            return path[len(self._repo_prefix):]
+        return str(Path(path).relative_to(self.repo_path))
+    
+    def _parse_file(self, file_path: Union[str, Path]) -> Tuple[str, Dict[str, List[Any]], Optional[CacheEntry]]:
+        """
+        读取并解析单个文件，不修改索引状态（可在子进程中执行）
+        
+        启用持久化缓存时：
+        - 文件 (mtime_ns, size) 未变化，直接复用缓存结果，不读取文件
+        - 内容 sha256 命中，跳过 tree-sitter 解析和 AST 遍历
+        
+        Returns:
+            (file_key, {"functions": [...], "structs": [...], "includes": [...]}, cache_entry)
+            cache_entry 为需要写回缓存的 (sha, mtime_ns, size)；无需写回时为 None
+        
+        Raises:
+            OSError: 读取文件失败
+        """
+        file_key = self._file_key(file_path)
+        cache = self._get_cache()
+        
+        if cache is None:
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+            return file_key, self._extract_info(file_path, raw, file_key), None
+        
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            cached = cache.get_by_stat(file_key, st.st_mtime_ns, st.st_size)
+            if cached is not None:
+                return file_key, cached, None
+            raw = f.read()
+        
+        sha = hashlib.sha256(raw).digest()
+        cache_entry = (sha, st.st_mtime_ns, st.st_size)
+        
+        # 内容未变（仅 mtime 变化）时复用结果，但仍写回新的文件状态
+        info = cache.get(file_key, sha)
+        if info is None:
+            info = self._extract_info(file_path, raw, file_key)
+        return file_key, info, cache_entry
+    
+    def _extract_info(self, file_path: Union[str, Path], raw: bytes, file_key: str) -> Dict[str, List[Any]]:
+        """按文件类型提取函数、结构体/类和依赖信息（raw 为文件原始字节）"""
+        suffix = os.path.splitext(file_path)[1]
+        
+        # 检查是否支持 tree-sitter 解析：直接解析原始字节，节点偏移即字节偏移
         if self._ts_parser.supports(suffix):
-            root_node = self._ts_parser.parse(content, suffix)
+            root_node = self._ts_parser.parse(raw, suffix)
             if root_node:
                 if suffix == '.py':
-                    info = self._extract_python_info(root_node, content, file_key)
-                    self.functions[file_key] = info["functions"]
-                    self.structs[file_key] = info["classes"]
-                    self.includes[file_key] = info["imports"]
+                    info = self._extract_python_info(root_node, raw, file_key)
                     return {
-                        "functions": len(info["functions"]),
-                        "classes": len(info["classes"]),
-                        "imports": len(info["imports"])
-                    }
-                else:  # C/C++
-                    info = self._extract_c_info(root_node, content, file_key)
-                    self.functions[file_key] = info["functions"]
-                    self.structs[file_key] = info["structs"]
-                    self.includes[file_key] = info["includes"]
-                    return {
-                        "functions": len(info["functions"]),
-                        "structs": len(info["structs"]),
-                        "includes": len(info["includes"])
+                        "functions": info["functions"],
+                        "structs": info["classes"],
+                        "includes": info["imports"]
                     }
+                # C/C++
+                return self._extract_c_info(root_node, raw, file_key)
         
         # 回退到正则表达式解析（用于不支持的语言）
-        return self._index_file_regex(file_path, content, file_key)
+        return self._index_file_regex(file_path, _decode_source(raw), file_key)
     
-    def _index_file_regex(self, file_path: Path, content: str, file_key: str) -> Dict[str, Any]:
-        """使用正则表达式索引文件（回退方案）"""
-        import re
+    def _store_file_info(self, file_key: str, info: Dict[str, List[Any]]) -> None:
+        """
+        将单个文件的解析结果写入索引
         
-        suffix = file_path.suffix
+        从缓存或子进程得到的记录各自持有一份文件路径等字符串副本，这里统一
+        指向同一个 file_key，并驻留重复度高的返回类型，降低索引的内存占用
+        """
+        for record in info["functions"]:
+            record["file"] = file_key
+            return_type = record.get("return_type")
+            if return_type:
+                record["return_type"] = sys.intern(return_type)
+        for record in info["structs"]:
+            record["file"] = file_key
+        
+        replaced_functions = self.functions.get(file_key)
+        if replaced_functions is not None:
+            self.function_count -= len(replaced_functions)
+            self.struct_count -= len(self.structs.get(file_key, ()))
+        self.function_count += len(info["functions"])
+        self.struct_count += len(info["structs"])
+        
+        self.functions[file_key] = info["functions"]
+        self.structs[file_key] = info["structs"]
+        self.includes[file_key] = info["includes"]
+        self._function_index = None
+        self._struct_index = None
+    
+    def _index_file_regex(self, file_path: Union[str, Path], content: str, file_key: str) -> Dict[str, List[Any]]:
+        """使用正则表达式提取文件信息（回退方案）"""
         functions = []
         structs = []
         includes = []
         
-        if suffix in ['.js', '.ts']:
-            # JavaScript/TypeScript 函数
-            func_patterns = [
-                r'function\s+(\w+)\s*\(([^)]*)\)',  # function name()
-                r'(?:const|let|var)\s+(\w+)\s*=\s*(?:async\s*)?\([^)]*\)\s*=>',  # arrow function
-                r'(\w+)\s*:\s*(?:async\s*)?function\s*\(([^)]*)\)',  # method: function()
-            ]
+        patterns = _REGEX_PATTERNS.get(os.path.splitext(file_path)[1])
+        if patterns is not None:
+            func_patterns, struct_patterns, include_patterns = patterns
+            # 行号 = 匹配位置之前的换行符数量 + 1，二分查找代替逐次切片计数
+            newlines = _newline_offsets(content)
+            
             for pattern in func_patterns:
-                for match in re.finditer(pattern, content):
-                    line_num = content[:match.start()].count('\n') + 1
+                for match in pattern.finditer(content):
                     functions.append({
                         "name": match.group(1),
-                        "parameters": match.group(2) if len(match.groups()) > 1 else "",
-                        "line": line_num,
+                        "parameters": match.group(2) if pattern.groups > 1 else "",
+                        "line": bisect.bisect_left(newlines, match.start()) + 1,
                         "file": file_key
                     })
             
-            # 类定义
-            class_pattern = r'class\s+(\w+)'
-            for match in re.finditer(class_pattern, content):
-                line_num = content[:match.start()].count('\n') + 1
-                structs.append({
-                    "name": match.group(1),
-                    "line": line_num,
-                    "file": file_key
-                })
-            
-            # import 语句
-            import_pattern = r'import\s+.*?from\s+[\'"]([^\'"]+)[\'"]'
-            for match in re.finditer(import_pattern, content):
-                includes.append(match.group(1))
-        
-        elif suffix in ['.go']:
-            # Go 函数
-            func_pattern = r'func\s+(?:\([^)]+\)\s+)?(\w+)\s*\(([^)]*)\)'
-            for match in re.finditer(func_pattern, content):
-                line_num = content[:match.start()].count('\n') + 1
-                functions.append({
-                    "name": match.group(1),
-                    "parameters": match.group(2),
-                    "line": line_num,
-                    "file": file_key
-                })
-            
-            # 结构体
-            struct_pattern = r'type\s+(\w+)\s+struct'
-            for match in re.finditer(struct_pattern, content):
-                line_num = content[:match.start()].count('\n') + 1
-                structs.append({
-                    "name": match.group(1),
-                    "line": line_num,
-                    "file": file_key
-                })
-        
-        elif suffix in ['.java']:
-            # Java 方法
-            method_pattern = r'(?:public|private|protected)?\s*(?:static)?\s*\w+\s+(\w+)\s*\(([^)]*)\)\s*(?:throws\s+\w+(?:,\s*\w+)*)?\s*\{'
-            for match in re.finditer(method_pattern, content):
-                line_num = content[:match.start()].count('\n') + 1
-                functions.append({
-                    "name": match.group(1),
-                    "parameters": match.group(2),
-                    "line": line_num,
-                    "file": file_key
-                })
+            for pattern in struct_patterns:
+                for match in pattern.finditer(content):
+                    structs.append({
+                        "name": match.group(1),
+                        "line": bisect.bisect_left(newlines, match.start()) + 1,
+                        "file": file_key
+                    })
             
-            # 类定义
-            class_pattern = r'(?:public|private)?\s*class\s+(\w+)'
-            for match in re.finditer(class_pattern, content):
-                line_num = content[:match.start()].count('\n') + 1
-                structs.append({
-                    "name": match.group(1),
-                    "line": line_num,
-                    "file": file_key
-                })
-        
-        self.functions[file_key] = functions
-        self.structs[file_key] = structs
-        self.includes[file_key] = includes
+            for pattern in include_patterns:
+                for match in pattern.finditer(content):
+                    includes.append(match.group(1))
         
         return {
-            "functions": len(functions),
-            "structs": len(structs),
-            "includes": len(includes)
+            "functions": functions,
+            "structs": structs,
+            "includes": includes
         }
     
     def index_all_files(self) -> Dict[str, Any]:
@@ -439,46 +655,143 @@ class CodeIndexer:
         
         logger.info(f"开始索引 {len(self.files)} 个文件")
         
-        for file_path in self.files:
-            try:
-                self.index_file(file_path)
-                results["indexed"] += 1
-            except Exception as e:
-                logger.warning(f"索引文件失败 {file_path}: {e}")
-                results["errors"] += 1
+        # 文件状态未变化的直接从缓存载入，只解析发生变化的文件
+        to_parse = self._load_unchanged_files(results)
+        
+        # 缓存未命中的解析结果，索引结束后在一个事务中写回
+        pending_cache: List[PendingCacheEntry] = []
+        
+        workers = min(os.cpu_count() or 1, len(to_parse))
+        if workers > 1 and len(to_parse) >= config.INDEX_PROCESS_MIN_FILES:
+            self._index_files_parallel(to_parse, results, pending_cache)
+        elif workers > 1:
+            # tree-sitter 解析期间释放 GIL，线程即可让多个文件的解析并行
+            logger.debug(f"使用 {workers} 个线程并行解析")
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="indexer") as executor:
+                self._collect_outcomes(
+                    executor.map(self._try_parse_file, to_parse), results, pending_cache
+                )
+        else:
+            self._collect_outcomes(map(self._try_parse_file, to_parse), results, pending_cache)
+        
+        if pending_cache:
+            self._cache.put_many(pending_cache)
         
-        results["total_functions"] = sum(len(funcs) for funcs in self.functions.values())
-        results["total_structs"] = sum(len(structs) for structs in self.structs.values())
+        results["total_functions"] = self.function_count
+        results["total_structs"] = self.struct_count
         
         logger.info(f"索引完成: {results['indexed']} 文件, "
                    f"{results['total_functions']} 函数, {results['total_structs']} 结构体/类")
         
         return results
     
+    def _load_unchanged_files(self, results: Dict[str, Any]) -> List[str]:
+        """
+        从持久化缓存载入 (mtime_ns, size) 未变化的文件
+        
+        Returns:
+            仍需读取解析的文件列表
+        """
+        cache = self._get_cache()
+        if cache is None:
+            return self.files
+        
+        to_parse = []
+        for file_path in self.files:
+            file_key = self._file_key(file_path)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                # 交给解析阶段统一报告读取错误
+                to_parse.append(file_path)
+                continue
+            
+            cached = cache.get_by_stat(file_key, st.st_mtime_ns, st.st_size)
+            if cached is None:
+                to_parse.append(file_path)
+                continue
+            self._store_file_info(file_key, cached)
+            results["indexed"] += 1
+        
+        if len(to_parse) < len(self.files):
+            logger.debug(f"缓存命中 {len(self.files) - len(to_parse)} 个未变化文件")
+        return to_parse
+    
+    def _try_parse_file(self, file_path: str) -> ParseOutcome:
+        """解析单个文件并捕获异常，供串行、线程池和进程池共用"""
+        try:
+            return file_path, self._parse_file(file_path), None
+        except OSError as e:
+            # 读取失败只记录，不计入错误数
+            logger.error(f"读取文件失败 {file_path}: {e}")
+            return file_path, None, None
+        except Exception as e:
+            return file_path, None, str(e)
+    
+    def _collect_outcomes(
+        self,
+        outcomes: Iterable[ParseOutcome],
+        results: Dict[str, Any],
+        pending_cache: List[PendingCacheEntry]
+    ) -> None:
+        """按文件顺序合并解析结果，并记录需要写回缓存的条目"""
+        for file_path, parsed, error in outcomes:
+            if error is not None:
+                logger.warning(f"索引文件失败 {file_path}: {error}")
+                results["errors"] += 1
+                continue
+            if parsed is not None:
+                file_key, info, cache_entry = parsed
+                self._store_file_info(file_key, info)
+                if cache_entry is not None:
+                    pending_cache.append((file_key, *cache_entry, info))
+            results["indexed"] += 1
+    
+    def _index_files_parallel(
+        self,
+        files: List[str],
+        results: Dict[str, Any],
+        pending_cache: List[PendingCacheEntry]
+    ) -> None:
+        """
+        用进程池并行解析文件，主进程串行合并结果
+        
+        文件较多时，解析后的查询匹配与结果构建（持有 GIL）也成为瓶颈，
+        因此使用进程而非线程；使用 spawn 启动方式，避免在多线程的服务进程中 fork。
+        """
+        workers = os.cpu_count() or 1
+        logger.debug(f"使用 {workers} 个进程并行索引")
+        
+        # 父进程先打开（必要时创建）缓存，保证写回时可用；
+        # 子进程以 mode=ro 只读连接，不执行 PRAGMA/建表，结果交回父进程写入
+        self._get_cache()
+        
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_index_worker,
+            initargs=(str(self.repo_path),),
+        ) as executor:
+            self._collect_outcomes(
+                executor.map(_index_in_worker, files, chunksize=32), results, pending_cache
+            )
+    
     def search_function(self, keyword: str) -> List[Dict[str, Any]]:
         """搜索函数名包含关键字的所有函数"""
-        results = []
-        keyword_lower = keyword.lower()
-        
-        for file_key, functions in self.functions.items():
-            for func in functions:
-                if keyword_lower in func["name"].lower():
-                    results.append(func)
+        if self._function_index is None:
+            self._function_index = _NameIndex(self.functions)
+        results = self._function_index.search(keyword.lower())
         
-        logger.debug(f"搜索 '{keyword}' 找到 {len(results)} 个函数")
+        logger.debug("搜索 '%s' 找到 %d 个函数", keyword, len(results))
         return results
     
     def search_struct(self, keyword: str) -> List[Dict[str, Any]]:
         """搜索结构体/类名包含关键字的所有定义"""
-        results = []
-        keyword_lower = keyword.lower()
-        
-        for file_key, structs in self.structs.items():
-            for struct in structs:
-                if keyword_lower in struct["name"].lower():
-                    results.append(struct)
+        if self._struct_index is None:
+            self._struct_index = _NameIndex(self.structs)
+        results = self._struct_index.search(keyword.lower())
         
-        logger.debug(f"搜索 '{keyword}' 找到 {len(results)} 个结构体/类")
+        logger.debug("搜索 '%s' 找到 %d 个结构体/类", keyword, len(results))
         return results
     
     def get_file_content(
@@ -488,23 +801,56 @@ class CodeIndexer:
         end_line: Optional[int] = None
     ) -> str:
         """获取文件内容"""
-        file_path = self.repo_path / file_key
-        
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                if start_line is None and end_line is None:
-                    return f.read()
-                
-                lines = f.readlines()
-                if start_line is not None and end_line is not None:
-                    return ''.join(lines[start_line - 1:end_line])
-                elif start_line is not None:
-                    return ''.join(lines[start_line - 1:])
-                else:
-                    return ''.join(lines[:end_line])
+            lines = self._read_lines(file_key)
         except Exception as e:
             logger.error(f"读取文件内容失败 {file_key}: {e}")
             return f"Error reading file: {e}"
+        
+        if start_line is not None and end_line is not None:
+            return ''.join(lines[start_line - 1:end_line])
+        elif start_line is not None:
+            return ''.join(lines[start_line - 1:])
+        elif end_line is not None:
+            return ''.join(lines[:end_line])
+        return ''.join(lines)
+    
+    def _read_lines(self, file_key: str) -> List[str]:
+        """
+        读取文件的行列表，按 (mtime_ns, size) 校验缓存（可在多个线程中调用）
+        
+        Raises:
+            OSError: 读取文件失败
+        """
+        file_path = self.repo_path / file_key
+        st = os.stat(file_path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        
+        with self._content_lock:
+            cached = self._content_cache.get(file_key)
+            if cached is not None and cached[0] == stamp:
+                self._content_cache.move_to_end(file_key)
+                return cached[1]
+        
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            lines = f.readlines()
+        
+        with self._content_lock:
+            replaced = self._content_cache.pop(file_key, None)
+            if replaced is not None:
+                self._content_cache_bytes -= replaced[0][1]
+            self._content_cache[file_key] = (stamp, lines)
+            self._content_cache_bytes += st.st_size
+            # 至少保留刚读入的文件
+            while (self._content_cache_bytes > config.FILE_CONTENT_CACHE_BYTES
+                   and len(self._content_cache) > 1):
+                _, ((_, size), _) = self._content_cache.popitem(last=False)
+                self._content_cache_bytes -= size
+        return lines
+    
+    def iter_functions(self) -> Iterator[Dict[str, Any]]:
+        """按文件顺序逐个产出函数记录（只取前 N 个时无需构建完整列表）"""
+        return chain.from_iterable(self.functions.values())
     
     def get_all_functions(self) -> List[Dict[str, Any]]:
         """获取所有函数列表"""
@@ -519,3 +865,18 @@ class CodeIndexer:
         for structs in self.structs.values():
             all_structs.extend(structs)
         return all_structs
+
+
+# ---------- 进程池 worker ----------
+_worker_indexer: Optional[CodeIndexer] = None
+
+
+def _init_index_worker(repo_path: str) -> None:
+    """子进程初始化：每个进程创建一次索引器（及共享的 tree-sitter 解析器）"""
+    global _worker_indexer
+    _worker_indexer = CodeIndexer(repo_path, read_only_cache=True)
+
+
+def _index_in_worker(file_path: str) -> ParseOutcome:
+    """在子进程中解析单个文件，返回 (file_path, 解析结果, 错误信息)"""
+    return _worker_indexer._try_parse_file(file_path)
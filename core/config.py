@@ -1,13 +1,13 @@
 """配置管理模块"""
 import os
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 
 class Config:
     """项目配置"""
 
-    # 代码扫描配置
-    DEFAULT_EXTENSIONS: List[str] = [
+    # 代码扫描配置（不可变，按顺序输出扫描统计）
+    DEFAULT_EXTENSIONS: Tuple[str, ...] = (
         ".py",
         ".c",
         ".h",
@@ -18,10 +18,10 @@ class Config:
         ".ts",
         ".go",
         ".rs",
-    ]
+    )
 
     # 忽略模式（可用于文件/目录）
-    IGNORE_PATTERNS: List[str] = [
+    IGNORE_PATTERNS: Tuple[str, ...] = (
         ".git",
         "__pycache__",
         "node_modules",
@@ -41,13 +41,30 @@ class Config:
         "build",
         "target",
         "*.egg-info",
-    ]
+    )
 
     # 工作流/分析配置
     MAX_TRACE_DEPTH: int = 5
     MAX_SEARCH_RESULTS: int = 50
     MAX_SNIPPET_LENGTH: int = 500
+    # 会话空闲超时（秒），超时的会话在下次访问注册表时淘汰；0 表示不超时
     SESSION_TIMEOUT: int = 3600
+    # 同时保留的会话上限（每个会话持有一份完整索引），超出后淘汰最久未用的会话
+    MAX_SESSIONS: int = 32
+    ANALYZER_FILE_CACHE_SIZE: int = 256
+    # 每个分析器缓存的追踪/路径/概念分析结果条数
+    ANALYSIS_RESULT_CACHE_SIZE: int = 128
+    MAX_IO_WORKERS: int = 16
+    MMAP_MIN_BYTES: int = 1024 * 1024
+    INDEX_PROCESS_MIN_FILES: int = 200
+    # get_file_content 的文件内容缓存上限（按文件大小累计）
+    FILE_CONTENT_CACHE_BYTES: int = 64 * 1024 * 1024
+    # 持久化解析缓存目录（每个仓库一个 index_v{版本}_{哈希}.sqlite，旧版本文件自动删除），
+    # 设置为空字符串可关闭缓存；见 README「解析缓存」
+    INDEX_CACHE_DIR: str = os.getenv(
+        "INDEX_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "hana-learncode"),
+    )
 
     # 日志配置
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
@@ -58,22 +75,21 @@ class Config:
     SERVER_NAME: str = "CodeLearnAssistant"
 
     @classmethod
-    def get_extensions(cls, custom: Optional[List[str]] = None) -> List[str]:
-        """返回要扫描的扩展名列表，支持环境/参数覆盖。"""
+    def get_extensions(cls, custom: Optional[List[str]] = None) -> Tuple[str, ...]:
+        """返回要扫描的扩展名，支持环境/参数覆盖。"""
         if custom:
-            return custom
+            return tuple(custom)
         env_ext = os.getenv("CODE_EXTENSIONS")
         if env_ext:
-            return [ext.strip() for ext in env_ext.split(",") if ext.strip()]
+            return tuple(ext.strip() for ext in env_ext.split(",") if ext.strip())
         return cls.DEFAULT_EXTENSIONS
 
     @classmethod
-    def get_ignore_patterns(cls, additional: Optional[List[str]] = None) -> List[str]:
-        """返回忽略模式列表，允许追加自定义模式。"""
-        patterns = cls.IGNORE_PATTERNS.copy()
+    def get_ignore_patterns(cls, additional: Optional[List[str]] = None) -> Tuple[str, ...]:
+        """返回忽略模式，允许追加自定义模式。"""
         if additional:
-            patterns.extend(additional)
-        return patterns
+            return cls.IGNORE_PATTERNS + tuple(additional)
+        return cls.IGNORE_PATTERNS
 
 
 config = Config()
@@ -1,5 +1,7 @@
 """流程图生成器 - 生成 Mermaid 格式的流程图"""
-from typing import Dict, List, Optional, Any
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Any, Tuple
 
 from core.logger import get_logger
 
@@ -9,16 +11,28 @@ logger = get_logger("flowchart_generator")
 class FlowchartGenerator:
     """流程图生成器，生成 Mermaid 格式的流程图"""
     
+    # 标签缓存的最大条目数，超出后按插入顺序淘汰
+    _LABEL_CACHE_SIZE = 4096
+    
     def __init__(self):
         self.node_counter: int = 0
         self.node_map: Dict[str, str] = {}
+        # 清理后的标签缓存：(原始文本, 最大长度) -> 标签（同名函数/文件在图中反复出现）
+        self._label_cache: Dict[Tuple[str, int], str] = {}
     
-    def _get_node_id(self, name: str) -> str:
-        """获取或创建节点 ID"""
-        if name not in self.node_map:
-            self.node_counter += 1
-            self.node_map[name] = f"node{self.node_counter}"
-        return self.node_map[name]
+    def _get_node_id(self, name: str) -> Tuple[str, bool]:
+        """
+        获取或创建节点 ID
+        
+        Returns:
+            (节点 ID, 是否为新创建的节点)，调用方据此只声明一次节点
+        """
+        node_id = self.node_map.get(name)
+        if node_id is not None:
+            return node_id, False
+        self.node_counter += 1
+        node_id = self.node_map[name] = f"node{self.node_counter}"
+        return node_id, True
     
     def _sanitize_label(self, text: str, max_length: int = 50) -> str:
         """
@@ -31,18 +45,29 @@ class FlowchartGenerator:
         Returns:
             清理后的文本
         """
+        key = (text, max_length)
+        label = self._label_cache.get(key)
+        if label is not None:
+            return label
+        
         # 移除或转义特殊字符
         text = text.replace('"', "'")
         text = text.replace('\n', ' ')
         text = text.replace('\r', '')
         text = text.replace('(', '[')
         text = text.replace(')', ']')
-        return text[:max_length]
+        label = text[:max_length]
+        
+        if len(self._label_cache) >= self._LABEL_CACHE_SIZE:
+            del self._label_cache[next(iter(self._label_cache))]
+        self._label_cache[key] = label
+        return label
     
     def _reset(self):
         """重置生成器状态"""
         self.node_counter = 0
         self.node_map = {}
+        self._label_cache.clear()
     
     def generate_call_tree_flowchart(
         self, 
@@ -61,46 +86,52 @@ class FlowchartGenerator:
         """
         self._reset()
         
-        logger.debug(f"生成调用树流程图，方向: {direction}")
+        logger.debug("生成调用树流程图，方向: %s", direction)
         
         mermaid = [f"graph {direction}"]
         
-        # 递归生成节点和边
+        # 生成节点和边
         self._add_call_tree_nodes(call_tree, mermaid)
         
         return "\n".join(mermaid)
     
     def _add_call_tree_nodes(
         self, 
-        node: Dict[str, Any], 
-        mermaid: List[str], 
-        parent_id: Optional[str] = None
+        call_tree: Dict[str, Any], 
+        mermaid: List[str]
     ):
-        """递归添加调用树节点"""
-        name = node.get("name", "unknown")
-        file = node.get("file", "")
-        line = node.get("line", 0)
-        
-        # 创建节点
-        node_id = self._get_node_id(f"{file}:{name}")
-        
-        # 文件名简化
-        file_name = file.split('/')[-1] if file else ""
-        label = f"{name}\\n({file_name}:{line})" if file_name else name
-        label = self._sanitize_label(label)
-        
-        # 根节点使用不同的样式
-        if parent_id is None:
-            mermaid.append(f'    {node_id}["{label}"]')
-            mermaid.append(f"    style {node_id} fill:#f9f,stroke:#333,stroke-width:4px")
-        else:
-            mermaid.append(f'    {node_id}["{label}"]')
-            mermaid.append(f"    {parent_id} --> {node_id}")
-        
-        # 处理子调用
-        calls = node.get("calls", [])
-        for call in calls:
-            self._add_call_tree_nodes(call, mermaid, node_id)
+        """
+        添加调用树节点
+        
+        显式栈先序遍历（子调用逆序入栈，输出顺序与递归一致），深层调用树不受递归深度限制
+        """
+        stack: List[Tuple[Dict[str, Any], Optional[str]]] = [(call_tree, None)]
+        while stack:
+            node, parent_id = stack.pop()
+            get = node.get
+            name = get("name", "unknown")
+            file = get("file", "")
+            line = get("line", 0)
+            
+            # 创建节点（同一函数在多个调用方下出现时只声明一次）
+            node_id, is_new = self._get_node_id(f"{file}:{name}")
+            if is_new:
+                # 文件名简化
+                file_name = os.path.basename(file)
+                label = f"{name}\\n({file_name}:{line})" if file_name else name
+                label = self._sanitize_label(label)
+                mermaid.append(f'    {node_id}["{label}"]')
+            
+            # 根节点使用不同的样式
+            if parent_id is None:
+                mermaid.append(f"    style {node_id} fill:#f9f,stroke:#333,stroke-width:4px")
+            else:
+                mermaid.append(f"    {parent_id} --> {node_id}")
+            
+            # 处理子调用
+            calls = get("calls", ())
+            for call in reversed(calls):
+                stack.append((call, node_id))
     
     def generate_function_path_flowchart(
         self, 
@@ -122,7 +153,7 @@ class FlowchartGenerator:
         
         self._reset()
         
-        logger.debug(f"生成路径流程图，共 {len(paths)} 条路径")
+        logger.debug("生成路径流程图，共 %d 条路径", len(paths))
         
         mermaid = [f"graph {direction}"]
         
@@ -137,7 +168,7 @@ class FlowchartGenerator:
             
             prev_id = None
             for func_name in path:
-                node_id = self._get_node_id(f"path{path_idx}_{func_name}")
+                node_id, _ = self._get_node_id(f"path{path_idx}_{func_name}")
                 label = self._sanitize_label(func_name)
                 mermaid.append(f'    {node_id}["{label}"]')
                 
@@ -174,7 +205,7 @@ class FlowchartGenerator:
         
         self._reset()
         
-        logger.debug(f"生成概念流程图: {concept}, 函数数: {len(functions)}")
+        logger.debug("生成概念流程图: %s, 函数数: %d", concept, len(functions))
         
         mermaid = [f"graph {direction}"]
         
@@ -184,16 +215,13 @@ class FlowchartGenerator:
         mermaid.append(f"    style {concept_id} fill:#ff9,stroke:#333,stroke-width:4px")
         
         # 按文件分组
-        files: Dict[str, List[Dict]] = {}
+        files: Dict[str, List[Dict]] = defaultdict(list)
         for func in functions:
-            file = func.get("file", "unknown")
-            if file not in files:
-                files[file] = []
-            files[file].append(func)
+            files[func.get("file", "unknown")].append(func)
         
         # 为每个文件创建子图
         for file_idx, (file, file_funcs) in enumerate(files.items()):
-            file_name = file.split('/')[-1]
+            file_name = os.path.basename(file)
             safe_name = self._sanitize_label(file_name).replace(' ', '_').replace('.', '_')
             mermaid.append(f"    subgraph {safe_name}")
             
@@ -201,7 +229,7 @@ class FlowchartGenerator:
                 func_name = func.get("name", "unknown")
                 line = func.get("line", 0)
                 
-                node_id = self._get_node_id(f"{file}:{func_name}")
+                node_id, _ = self._get_node_id(f"{file}:{func_name}")
                 label = f"{func_name}\\n[L{line}]"
                 mermaid.append(f'    {node_id}["{self._sanitize_label(label)}"]')
                 mermaid.append(f"    {concept_id} -.-> {node_id}")
@@ -231,26 +259,22 @@ class FlowchartGenerator:
         self._reset()
         
         mermaid = [f"graph {direction}"]
+        last = len(steps) - 1
+        
+        # 第一步和最后一步使用特殊形状，中间步骤单独循环，无需逐步判断位置
+        mermaid.append(f'    step1(["{self._sanitize_label(steps[0])}"])')
+        mermaid.append("    style step1 fill:#9f9,stroke:#333,stroke-width:2px")
         
-        prev_id = None
-        for idx, step in enumerate(steps):
+        for idx in range(1, last):
             node_id = f"step{idx + 1}"
-            label = self._sanitize_label(step)
-            
-            # 第一步和最后一步使用特殊形状
-            if idx == 0:
-                mermaid.append(f'    {node_id}(["{label}"])')
-                mermaid.append(f"    style {node_id} fill:#9f9,stroke:#333,stroke-width:2px")
-            elif idx == len(steps) - 1:
-                mermaid.append(f'    {node_id}(["{label}"])')
-                mermaid.append(f"    style {node_id} fill:#f99,stroke:#333,stroke-width:2px")
-            else:
-                mermaid.append(f'    {node_id}["{label}"]')
-            
-            if prev_id:
-                mermaid.append(f"    {prev_id} --> {node_id}")
-            
-            prev_id = node_id
+            mermaid.append(f'    {node_id}["{self._sanitize_label(steps[idx])}"]')
+            mermaid.append(f"    step{idx} --> {node_id}")
+        
+        if last > 0:
+            node_id = f"step{last + 1}"
+            mermaid.append(f'    {node_id}(["{self._sanitize_label(steps[last])}"])')
+            mermaid.append(f"    style {node_id} fill:#f99,stroke:#333,stroke-width:2px")
+            mermaid.append(f"    step{last} --> {node_id}")
         
         return "\n".join(mermaid)
     
@@ -274,27 +298,25 @@ class FlowchartGenerator:
         
         self._reset()
         
-        logger.debug(f"生成依赖图，模块数: {len(includes)}")
+        logger.debug("生成依赖图，模块数: %d", len(includes))
         
         mermaid = [f"graph {direction}"]
-        declared_nodes = set()
         
         # 创建所有节点和边
         for file, deps in includes.items():
-            file_name = file.split('/')[-1]
-            file_id = self._get_node_id(file)
+            file_id, is_new = self._get_node_id(file)
             
-            if file_id not in declared_nodes:
+            # 只在首次声明节点时提取文件名
+            if is_new:
+                file_name = os.path.basename(file)
                 mermaid.append(f'    {file_id}["{self._sanitize_label(file_name)}"]')
-                declared_nodes.add(file_id)
             
             for dep in deps:
-                dep_name = dep.split('/')[-1]
-                dep_id = self._get_node_id(dep)
+                dep_id, is_new = self._get_node_id(dep)
                 
-                if dep_id not in declared_nodes:
+                if is_new:
+                    dep_name = os.path.basename(dep)
                     mermaid.append(f'    {dep_id}["{self._sanitize_label(dep_name)}"]')
-                    declared_nodes.add(dep_id)
                 
                 mermaid.append(f"    {file_id} --> {dep_id}")
         
@@ -313,26 +335,33 @@ class FlowchartGenerator:
         if not call_sequence:
             return "sequenceDiagram\n    participant A\n    A->>A: Empty"
         
-        logger.debug(f"生成时序图，调用数: {len(call_sequence)}")
+        logger.debug("生成时序图，调用数: %d", len(call_sequence))
         
         mermaid = ["sequenceDiagram"]
         
         # 收集所有参与者
         participants = set()
         for call in call_sequence:
-            participants.add(call.get("caller", "Unknown"))
-            participants.add(call.get("callee", "Unknown"))
+            get = call.get
+            participants.add(get("caller", "Unknown"))
+            participants.add(get("callee", "Unknown"))
+        
+        # 每个参与者只清理一次名称，调用序列中复用
+        safe_names = {
+            participant: self._sanitize_label(participant).replace(' ', '_')
+            for participant in participants
+        }
         
         # 声明参与者
         for participant in sorted(participants):
-            safe_name = self._sanitize_label(participant).replace(' ', '_')
-            mermaid.append(f"    participant {safe_name}")
+            mermaid.append(f"    participant {safe_names[participant]}")
         
         # 添加调用序列
         for call in call_sequence:
-            caller = self._sanitize_label(call.get("caller", "Unknown")).replace(' ', '_')
-            callee = self._sanitize_label(call.get("callee", "Unknown")).replace(' ', '_')
-            message = self._sanitize_label(call.get("message", "call"), 30)
+            get = call.get
+            caller = safe_names[get("caller", "Unknown")]
+            callee = safe_names[get("callee", "Unknown")]
+            message = self._sanitize_label(get("message", "call"), 30)
             
             mermaid.append(f"    {caller}->>{callee}: {message}")
         
@@ -351,22 +380,19 @@ class FlowchartGenerator:
         if not classes:
             return "classDiagram\n    class Empty"
         
-        logger.debug(f"生成类图，类数: {len(classes)}")
+        logger.debug("生成类图，类数: %d", len(classes))
         
         mermaid = ["classDiagram"]
         
+        sanitize = self._sanitize_label
         for cls in classes:
-            class_name = self._sanitize_label(cls.get("name", "Unknown"), 30)
-            mermaid.append(f"    class {class_name} {{")
-            
-            # 添加属性
-            for attr in cls.get("attributes", []):
-                mermaid.append(f"        +{self._sanitize_label(attr, 40)}")
-            
-            # 添加方法
-            for method in cls.get("methods", []):
-                mermaid.append(f"        +{self._sanitize_label(method, 40)}()")
+            class_name = sanitize(cls.get("name", "Unknown"), 30)
             
-            mermaid.append("    }")
+            # 每个类拼成一个文本块：类头、属性、方法、结束括号
+            block = [f"    class {class_name} {{"]
+            block.extend(f"        +{sanitize(attr, 40)}" for attr in cls.get("attributes", ()))
+            block.extend(f"        +{sanitize(method, 40)}()" for method in cls.get("methods", ()))
+            block.append("    }")
+            mermaid.append("\n".join(block))
         
         return "\n".join(mermaid)
@@ -3,6 +3,7 @@ MCP Resource 定义
 提供静态或动态的数据资源
 """
 import json
+from itertools import islice
 
 from workflow.registry import workflow_registry
 from core.logger import get_logger
@@ -10,6 +11,16 @@ from core.logger import get_logger
 logger = get_logger("resources")
 
 
+def _cached_json(wf, name: str, build) -> str:
+    """按会话版本号缓存 resource 的序列化结果，上下文未变化时直接复用"""
+    cached = wf.resource_cache.get(name)
+    if cached is not None and cached[0] == wf.version:
+        return cached[1]
+    payload = json.dumps(build(), ensure_ascii=False, indent=2)
+    wf.resource_cache[name] = (wf.version, payload)
+    return payload
+
+
 def register_resources(mcp):
     """注册所有 resource 到 MCP 服务器"""
     
@@ -25,7 +36,7 @@ def register_resources(mcp):
                 "session_id": sid,
                 "code_path": ctx.get("code_path", ""),
                 "scanned": indexer is not None,
-                "functions_count": sum(len(f) for f in indexer.functions.values()) if indexer else 0
+                "functions_count": indexer.function_count if indexer else 0
             })
         return json.dumps(session_list, ensure_ascii=False, indent=2)
     
@@ -35,20 +46,23 @@ def register_resources(mcp):
         wf = workflow_registry.get_session(session_id)
         if not wf:
             return json.dumps({"error": f"会话不存在: {session_id}"}, ensure_ascii=False)
-        ctx = wf.context
         
-        indexer = ctx.get("indexer")
-        return json.dumps({
-            "session_id": session_id,
-            "workflow_type": wf.workflow_type,
-            "code_path": ctx.get("code_path", ""),
-            "scanned": indexer is not None,
-            "functions_count": sum(len(f) for f in indexer.functions.values()) if indexer else 0,
-            "structs_count": sum(len(s) for s in indexer.structs.values()) if indexer else 0,
-            "traced_function": ctx.get("traced_function"),
-            "analyzed_concept": ctx.get("concept_analysis", {}).get("concept"),
-            "has_flowchart": ctx.get("flowchart") is not None
-        }, ensure_ascii=False, indent=2)
+        def build():
+            ctx = wf.context
+            indexer = ctx.get("indexer")
+            return {
+                "session_id": session_id,
+                "workflow_type": wf.workflow_type,
+                "code_path": ctx.get("code_path", ""),
+                "scanned": indexer is not None,
+                "functions_count": indexer.function_count if indexer else 0,
+                "structs_count": indexer.struct_count if indexer else 0,
+                "traced_function": ctx.get("traced_function"),
+                "analyzed_concept": ctx.get("concept_analysis", {}).get("concept"),
+                "has_flowchart": ctx.get("flowchart") is not None
+            }
+        
+        return _cached_json(wf, "info", build)
     
     @mcp.resource("code://session/{session_id}/functions")
     def get_session_functions(session_id: str) -> str:
@@ -56,17 +70,20 @@ def register_resources(mcp):
         wf = workflow_registry.get_session(session_id)
         if not wf:
             return json.dumps({"error": "会话不存在"}, ensure_ascii=False)
-        ctx = wf.context
         
-        indexer = ctx.get("indexer")
+        indexer = wf.context.get("indexer")
         if not indexer:
             return json.dumps({"error": "请先执行扫描"}, ensure_ascii=False)
         
-        all_functions = indexer.get_all_functions()
-        return json.dumps({
-            "total": len(all_functions),
-            "functions": all_functions[:100]
-        }, ensure_ascii=False, indent=2)
+        def build():
+            # 只取前 100 个，不拼接全部函数列表
+            functions = list(islice(indexer.iter_functions(), 100))
+            return {
+                "total": indexer.function_count,
+                "functions": functions
+            }
+        
+        return _cached_json(wf, "functions", build)
     
     @mcp.resource("code://session/{session_id}/flowchart")
     def get_session_flowchart(session_id: str) -> str:
@@ -80,10 +97,10 @@ def register_resources(mcp):
         if not flowchart:
             return json.dumps({"error": "请先生成流程图"}, ensure_ascii=False)
         
-        return json.dumps({
+        return _cached_json(wf, "flowchart", lambda: {
             "chart_info": ctx.get("chart_info", {}),
             "flowchart": flowchart
-        }, ensure_ascii=False, indent=2)
+        })
     
     @mcp.resource("code://help")
     def get_help() -> str:
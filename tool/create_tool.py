@@ -7,13 +7,12 @@ MCP Tool 注册模块
 
 该文件只保留“工具函数”本身的业务逻辑：扫描、搜索、追踪、概念分析、生成流程图。
 """
+import asyncio
+from functools import wraps
+from itertools import islice
 from typing import Optional, List
 from time import time
 
-from core.code_indexer import CodeIndexer
-from core.code_analyzer import CodeAnalyzer
-from core.flowchart_generator import FlowchartGenerator
-
 from core.logger import get_logger
 
 logger = get_logger("tools")
@@ -22,6 +21,9 @@ from workflow.bootstrap import init_workflows
 from workflow.engine import try_execute_step
 from workflow.registry import workflow_registry, WorkflowSession
 
+# 工具输出的分隔线
+_BORDER = "═" * 45
+
 
 def get_workflow(session_id: str) -> tuple:
     """获取工作流会话"""
@@ -31,9 +33,61 @@ def get_workflow(session_id: str) -> tuple:
     return wf, None
 
 
+def enter_step(session_id: str, step_name: str) -> tuple:
+    """获取会话并校验能否执行该步骤（必要时插入可重复步骤）"""
+    wf, error = get_workflow(session_id)
+    if error:
+        return None, error
+    can_execute, error = try_execute_step(wf, step_name)
+    if not can_execute:
+        return None, error
+    return wf, None
+
+
+def _parse_extensions(extensions: str) -> List[str]:
+    """解析逗号分隔的扩展名，忽略空项，并补全前导点（"py" -> ".py"）"""
+    ext_list = []
+    for ext in extensions.split(","):
+        ext = ext.strip()
+        if ext:
+            ext_list.append(ext if ext.startswith(".") else f".{ext}")
+    return ext_list
+
+
+def _tool_error_boundary(title: str):
+    """工具异常边界：未预期的异常记录日志并转换为错误输出，不抛给 MCP 框架"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"{title}: {e}")
+                return format_error(title, str(e))
+        return wrapper
+    return decorator
+
+
+def _serialize_session(func):
+    """
+    同一会话的工作流工具串行执行
+    
+    步骤校验和 advance 之间可能有 await（扫描/分析在线程中执行），
+    不加锁时同一会话的并发调用会都通过校验，导致步骤被重复推进。
+    """
+    @wraps(func)
+    async def wrapper(session_id: str, *args, **kwargs):
+        wf = workflow_registry.get_session(session_id)
+        if wf is None:
+            return await func(session_id, *args, **kwargs)
+        async with wf.step_lock:
+            return await func(session_id, *args, **kwargs)
+    return wrapper
+
+
 def format_success(title: str, message: str, data: dict = None, next_step: str = None) -> str:
     """格式化成功输出"""
-    lines = ["═" * 45, f"📋 {title}", "═" * 45, "", f"✅ {message}", ""]
+    lines = [_BORDER, f"📋 {title}", _BORDER, "", f"✅ {message}", ""]
     
     if data:
         lines.append("📊 数据:")
@@ -54,25 +108,25 @@ def format_success(title: str, message: str, data: dict = None, next_step: str =
         lines.append(f"➡️ 下一步: {next_step}")
         lines.append("")
     
-    lines.append("═" * 45)
+    lines.append(_BORDER)
     return "\n".join(lines)
 
 
 def format_error(title: str, message: str) -> str:
     """格式化错误输出"""
-    lines = ["═" * 45, f"❌ {title}", "═" * 45, ""]
+    lines = [_BORDER, f"❌ {title}", _BORDER, ""]
     for line in message.split('\n'):
         lines.append(f"  {line}")
     lines.append("")
-    lines.append("═" * 45)
+    lines.append(_BORDER)
     return "\n".join(lines)
 
 
 def format_workflow_status(workflow: WorkflowSession) -> str:
     """格式化工作流状态"""
-    status = workflow.get_status()
+    # 直接遍历步骤，不构建完整的状态字典
     steps_display = "  ".join(
-        f"[{name}]{mark}" for name, mark in status["steps"]
+        f"[{step.name}]{step.mark()}" for step in workflow.steps
     )
     return f"进度: {steps_display}"
 
@@ -91,7 +145,7 @@ def register_tools(mcp):
         
         Args:
             code_path: 代码仓库路径
-            extensions: 要扫描的文件扩展名，逗号分隔（可选）
+            extensions: 要扫描的文件扩展名，逗号分隔，可省略前导点（如 "py,c,h" 或 ".py,.c"；可选）
         
         Returns:
             初始化结果和 session_id
@@ -102,7 +156,7 @@ def register_tools(mcp):
         # 2) 创建会话 + 装配步骤
         ext_list = None
         if extensions:
-            ext_list = [ext.strip() for ext in extensions.split(",")]
+            ext_list = _parse_extensions(extensions)
 
         workflow = workflow_registry.create_session(
             workflow_type,
@@ -130,6 +184,8 @@ def register_tools(mcp):
         )
 
     @mcp.tool()
+    @_tool_error_boundary("扫描失败")
+    @_serialize_session
     async def scan_repository(
         session_id: str,
         repo_path: Optional[str] = None,
@@ -141,19 +197,15 @@ def register_tools(mcp):
         Args:
             session_id: 会话ID
             repo_path: 代码仓库路径（可选）
-            extensions: 文件扩展名（可选）
+            extensions: 文件扩展名，逗号分隔，可省略前导点（如 "py,c,h"；可选，覆盖初始化时的设置）
         
         Returns:
             扫描结果
         """
-        workflow, error = get_workflow(session_id)
+        workflow, error = enter_step(session_id, "scan_repository")
         if error:
             return error
         
-        can_execute, error = try_execute_step(workflow, "scan_repository")
-        if not can_execute:
-            return error
-        
         ctx = workflow.context
         path = repo_path or ctx.get("code_path")
         if not path:
@@ -161,38 +213,38 @@ def register_tools(mcp):
         
         ext_list = ctx.get("extensions")
         if extensions:
-            ext_list = [ext.strip() for ext in extensions.split(",")]
-        
-        try:
-            indexer = CodeIndexer(path)
-            scan_result = indexer.scan_repository(ext_list)
-            index_result = indexer.index_all_files()
-            
-            ctx["indexer"] = indexer
-            ctx["scan_result"] = scan_result
-            
-            # 前进到下一步
-            workflow.advance()
-            next_step = workflow.get_current_step()
-            
-            logger.info(f"扫描完成: {scan_result['total_files']} 文件")
-            
-            return format_success(
-                "扫描完成",
-                f"成功扫描 {scan_result['total_files']} 个文件\n{format_workflow_status(workflow)}",
-                {
-                    "文件数": scan_result["total_files"],
-                    "函数数": index_result["total_functions"],
-                    "类/结构体": index_result["total_structs"],
-                    "文件类型": scan_result.get("extensions", {})
-                },
-                f"执行 {next_step.name}(session_id)" if next_step else None
-            )
-        except Exception as e:
-            logger.error(f"扫描失败: {e}")
-            return format_error("扫描失败", str(e))
+            ext_list = _parse_extensions(extensions)
+        
+        # 索引/分析/绘图模块在首次使用时再导入，list_sessions 等轻量工具无需加载 tree-sitter
+        from core.code_indexer import CodeIndexer
+        indexer = CodeIndexer(path)
+        # 扫描和索引耗时较长，放到线程中执行，避免阻塞事件循环（其他会话的工具调用仍可响应）
+        scan_result = await asyncio.to_thread(indexer.scan_repository, ext_list)
+        index_result = await asyncio.to_thread(indexer.index_all_files)
+        
+        workflow.update_context(indexer=indexer, scan_result=scan_result)
+        
+        # 前进到下一步
+        workflow.advance()
+        next_step = workflow.get_current_step()
+        
+        logger.info(f"扫描完成: {scan_result['total_files']} 文件")
+        
+        return format_success(
+            "扫描完成",
+            f"成功扫描 {scan_result['total_files']} 个文件\n{format_workflow_status(workflow)}",
+            {
+                "文件数": scan_result["total_files"],
+                "函数数": index_result["total_functions"],
+                "类/结构体": index_result["total_structs"],
+                "文件类型": scan_result.get("extensions", {})
+            },
+            f"执行 {next_step.name}(session_id)" if next_step else None
+        )
 
     @mcp.tool()
+    @_tool_error_boundary("搜索失败")
+    @_serialize_session
     async def search_functions(
         session_id: str,
         keyword: Optional[str] = None
@@ -207,48 +259,45 @@ def register_tools(mcp):
         Returns:
             搜索结果
         """
-        workflow, error = get_workflow(session_id)
+        workflow, error = enter_step(session_id, "search_functions")
         if error:
             return error
         
-        can_execute, error = try_execute_step(workflow, "search_functions")
-        if not can_execute:
-            return error
-        
         ctx = workflow.context
         indexer = ctx.get("indexer")
         if not indexer:
             return format_error("搜索失败", "尚未扫描代码库，请先执行 scan_repository")
         
-        try:
-            if keyword:
-                functions = indexer.search_function(keyword)
-                ctx["found_functions"] = functions
-                ctx["search_keyword"] = keyword
-            else:
-                functions = indexer.get_all_functions()
-                ctx["found_functions"] = functions[:50]
-            
-            # 前进到下一步
-            workflow.advance()
-            next_step = workflow.get_current_step()
-            
-            result_msg = f"找到 {len(functions)} 个函数" if keyword else f"共 {len(functions)} 个函数"
-            
-            return format_success(
-                "搜索完成",
-                f"{result_msg}\n{format_workflow_status(workflow)}",
-                {
-                    "关键词": keyword or "全部",
-                    "结果数": len(functions),
-                    "函数列表": [f["name"] for f in functions[:15]]
-                },
-                f"执行 {next_step.name}(session_id)" if next_step else None
-            )
-        except Exception as e:
-            return format_error("搜索失败", str(e))
+        if keyword:
+            functions = indexer.search_function(keyword)
+            total = len(functions)
+            workflow.update_context(found_functions=functions, search_keyword=keyword)
+        else:
+            # 只保留前 50 个，不构建全部函数列表
+            functions = list(islice(indexer.iter_functions(), 50))
+            total = indexer.function_count
+            workflow.update_context(found_functions=functions)
+        
+        # 前进到下一步
+        workflow.advance()
+        next_step = workflow.get_current_step()
+        
+        result_msg = f"找到 {total} 个函数" if keyword else f"共 {total} 个函数"
+        
+        return format_success(
+            "搜索完成",
+            f"{result_msg}\n{format_workflow_status(workflow)}",
+            {
+                "关键词": keyword or "全部",
+                "结果数": total,
+                "函数列表": [f["name"] for f in functions[:15]]
+            },
+            f"执行 {next_step.name}(session_id)" if next_step else None
+        )
 
     @mcp.tool()
+    @_tool_error_boundary("追踪失败")
+    @_serialize_session
     async def trace_function_flow(
         session_id: str,
         function_name: Optional[str] = None,
@@ -265,14 +314,10 @@ def register_tools(mcp):
         Returns:
             追踪结果
         """
-        workflow, error = get_workflow(session_id)
+        workflow, error = enter_step(session_id, "trace_function_flow")
         if error:
             return error
         
-        can_execute, error = try_execute_step(workflow, "trace_function_flow")
-        if not can_execute:
-            return error
-        
         ctx = workflow.context
         indexer = ctx.get("indexer")
         if not indexer:
@@ -286,37 +331,36 @@ def register_tools(mcp):
             else:
                 return format_error("追踪失败", "请指定函数名，或先搜索函数")
         
-        try:
-            analyzer = ctx.get("analyzer") or CodeAnalyzer(indexer)
-            ctx["analyzer"] = analyzer
-            
-            flow = analyzer.trace_function_flow(func_name, max_depth)
-            
-            if "error" in flow:
-                return format_error("追踪失败", flow["error"])
-            
-            ctx["function_flow"] = flow
-            ctx["traced_function"] = func_name
-            
-            # 前进到下一步
-            workflow.advance()
-            next_step = workflow.get_current_step()
-            
-            return format_success(
-                "追踪完成",
-                f"成功追踪 '{func_name}'\n{format_workflow_status(workflow)}",
-                {
-                    "函数": func_name,
-                    "文件": flow.get("file", ""),
-                    "行号": flow.get("line", 0),
-                    "深度": max_depth
-                },
-                f"执行 {next_step.name}(session_id)" if next_step else None
-            )
-        except Exception as e:
-            return format_error("追踪失败", str(e))
+        from core.code_analyzer import CodeAnalyzer
+        analyzer = ctx.get("analyzer") or CodeAnalyzer(indexer)
+        workflow.update_context(analyzer=analyzer)
+        
+        flow = await asyncio.to_thread(analyzer.trace_function_flow, func_name, max_depth)
+        
+        if "error" in flow:
+            return format_error("追踪失败", flow["error"])
+        
+        workflow.update_context(function_flow=flow, traced_function=func_name)
+        
+        # 前进到下一步
+        workflow.advance()
+        next_step = workflow.get_current_step()
+        
+        return format_success(
+            "追踪完成",
+            f"成功追踪 '{func_name}'\n{format_workflow_status(workflow)}",
+            {
+                "函数": func_name,
+                "文件": flow.get("file", ""),
+                "行号": flow.get("line", 0),
+                "深度": max_depth
+            },
+            f"执行 {next_step.name}(session_id)" if next_step else None
+        )
 
     @mcp.tool()
+    @_tool_error_boundary("分析失败")
+    @_serialize_session
     async def analyze_concept(
         session_id: str,
         concept: str,
@@ -333,46 +377,42 @@ def register_tools(mcp):
         Returns:
             分析结果
         """
-        workflow, error = get_workflow(session_id)
+        workflow, error = enter_step(session_id, "analyze_concept")
         if error:
             return error
         
-        can_execute, error = try_execute_step(workflow, "analyze_concept")
-        if not can_execute:
-            return error
-        
         ctx = workflow.context
         indexer = ctx.get("indexer")
         if not indexer:
             return format_error("分析失败", "尚未扫描代码库，请先执行 scan_repository")
         keyword_list = [kw.strip() for kw in keywords.split(",")]
         
-        try:
-            analyzer = ctx.get("analyzer") or CodeAnalyzer(indexer)
-            ctx["analyzer"] = analyzer
-            
-            analysis = analyzer.analyze_concept(concept, keyword_list)
-            ctx["concept_analysis"] = analysis
-            
-            # 前进到下一步
-            workflow.advance()
-            next_step = workflow.get_current_step()
-            
-            return format_success(
-                "概念分析完成",
-                f"'{concept}' 相关函数: {analysis['total_functions']} 个\n{format_workflow_status(workflow)}",
-                {
-                    "概念": concept,
-                    "关键词": keyword_list,
-                    "函数数": analysis["total_functions"],
-                    "函数列表": [f["name"] for f in analysis.get("functions", [])[:10]]
-                },
-                f"执行 {next_step.name}(session_id, chart_type='concept')" if next_step else None
-            )
-        except Exception as e:
-            return format_error("分析失败", str(e))
+        from core.code_analyzer import CodeAnalyzer
+        analyzer = ctx.get("analyzer") or CodeAnalyzer(indexer)
+        workflow.update_context(analyzer=analyzer)
+        
+        analysis = await asyncio.to_thread(analyzer.analyze_concept, concept, keyword_list)
+        workflow.update_context(concept_analysis=analysis)
+        
+        # 前进到下一步
+        workflow.advance()
+        next_step = workflow.get_current_step()
+        
+        return format_success(
+            "概念分析完成",
+            f"'{concept}' 相关函数: {analysis['total_functions']} 个\n{format_workflow_status(workflow)}",
+            {
+                "概念": concept,
+                "关键词": keyword_list,
+                "函数数": analysis["total_functions"],
+                "函数列表": [f["name"] for f in analysis.get("functions", [])[:10]]
+            },
+            f"执行 {next_step.name}(session_id, chart_type='concept')" if next_step else None
+        )
 
     @mcp.tool()
+    @_tool_error_boundary("生成失败")
+    @_serialize_session
     async def generate_flowchart(
         session_id: str,
         chart_type: Optional[str] = None,
@@ -389,14 +429,10 @@ def register_tools(mcp):
         Returns:
             Mermaid格式流程图
         """
-        workflow, error = get_workflow(session_id)
+        workflow, error = enter_step(session_id, "generate_flowchart")
         if error:
             return error
         
-        can_execute, error = try_execute_step(workflow, "generate_flowchart")
-        if not can_execute:
-            return error
-        
         ctx = workflow.context
         function_flow = ctx.get("function_flow")
         concept_analysis = ctx.get("concept_analysis")
@@ -408,30 +444,29 @@ def register_tools(mcp):
                 "请先执行 trace_function_flow 或 analyze_concept"
             )
         
-        try:
-            generator = FlowchartGenerator()
-            flowchart = ""
-            chart_info = {}
-            
-            if chart_type == "concept" and concept_analysis:
-                flowchart = generator.generate_concept_flowchart(concept_analysis, direction)
-                chart_info = {"type": "concept", "name": concept_analysis.get("concept", "")}
-            elif function_flow:
-                flowchart = generator.generate_call_tree_flowchart(function_flow["call_tree"], direction)
-                chart_info = {"type": "call_tree", "name": function_flow.get("function", "")}
-            elif concept_analysis:
-                flowchart = generator.generate_concept_flowchart(concept_analysis, direction)
-                chart_info = {"type": "concept", "name": concept_analysis.get("concept", "")}
-            
-            ctx["flowchart"] = flowchart
-            ctx["chart_info"] = chart_info
-            
-            # 前进（完成）
-            workflow.advance()
-            
-            return f"""═══════════════════════════════════════════════
+        from core.flowchart_generator import FlowchartGenerator
+        generator = FlowchartGenerator()
+        flowchart = ""
+        chart_info = {}
+        
+        if chart_type == "concept" and concept_analysis:
+            flowchart = generator.generate_concept_flowchart(concept_analysis, direction)
+            chart_info = {"type": "concept", "name": concept_analysis.get("concept", "")}
+        elif function_flow:
+            flowchart = generator.generate_call_tree_flowchart(function_flow["call_tree"], direction)
+            chart_info = {"type": "call_tree", "name": function_flow.get("function", "")}
+        elif concept_analysis:
+            flowchart = generator.generate_concept_flowchart(concept_analysis, direction)
+            chart_info = {"type": "concept", "name": concept_analysis.get("concept", "")}
+        
+        workflow.update_context(flowchart=flowchart, chart_info=chart_info)
+        
+        # 前进（完成）
+        workflow.advance()
+        
+        return f"""{_BORDER}
 📊 流程图生成完成
-═══════════════════════════════════════════════
+{_BORDER}
 
 {format_workflow_status(workflow)}
 
@@ -442,11 +477,9 @@ def register_tools(mcp):
 {flowchart}
 ```
 
-═══════════════════════════════════════════════
+{_BORDER}
 ✅ 工作流已完成
-═══════════════════════════════════════════════"""
-        except Exception as e:
-            return format_error("生成失败", str(e))
+{_BORDER}"""
 
     @mcp.tool()
     async def get_workflow_status(session_id: str) -> str:
@@ -455,26 +488,27 @@ def register_tools(mcp):
         if error:
             return error
         
-        status = workflow.get_status()
-        ctx = workflow.context
+        current = workflow.get_current_step()
+        current_index = workflow.current_index
         
         lines = [
-            "═" * 45,
+            _BORDER,
             "📊 工作流状态",
-            "═" * 45,
+            _BORDER,
             "",
             f"会话ID: {session_id}",
-            f"当前步骤: {status['current_step'] or '已完成'}",
-            f"进度: {status['current_index']}/{status['total_steps']}",
+            f"当前步骤: {current.name if current else '已完成'}",
+            f"进度: {current_index}/{len(workflow.steps)}",
             "",
             "步骤队列:",
         ]
         
-        for i, (name, mark) in enumerate(status["steps"]):
-            indicator = "→" if i == workflow.current_index else " "
-            lines.append(f"  {indicator} {i+1}. [{name}] {mark}")
-        
-        lines.extend(["", "═" * 45])
+        # 直接遍历步骤生成队列行，不经过 get_status() 的中间字典
+        lines.extend(
+            f"  {'→' if i == current_index else ' '} {i + 1}. [{step.name}] {step.mark()}"
+            for i, step in enumerate(workflow.steps)
+        )
+        lines.extend(["", _BORDER])
         
         return "\n".join(lines)
 
@@ -485,7 +519,7 @@ def register_tools(mcp):
         if not sessions:
             return "📭 没有活跃会话\n\n使用 init_learn_code_workflow 创建"
         
-        lines = ["═" * 45, "📋 活跃会话", "═" * 45, ""]
+        lines = [_BORDER, "📋 活跃会话", _BORDER, ""]
         
         for wf in sessions:
             current = wf.get_current_step()
@@ -494,7 +528,7 @@ def register_tools(mcp):
             lines.append(f"   进度: {wf.current_index}/{len(wf.steps)}")
             lines.append("")
         
-        lines.append("═" * 45)
+        lines.append(_BORDER)
         return "\n".join(lines)
     
     logger.info("工具注册完成")
@@ -8,12 +8,19 @@
 
 from __future__ import annotations
 
+import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from enum import Enum
 from time import time
 from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
+from core.config import config
+from core.logger import get_logger
+
+logger = get_logger("registry")
+
 
 class StepType(Enum):
     """步骤类型"""
@@ -31,6 +38,10 @@ class Step:
     step_type: StepType
     executed: bool = False
 
+    def mark(self) -> str:
+        """进度标记：已执行 ✓，未执行 ○"""
+        return "✓" if self.executed else "○"
+
 
 @dataclass
 class WorkflowDefinition:
@@ -51,6 +62,13 @@ class WorkflowSession:
     steps: List[Step] = field(default_factory=list)
     current_index: int = 0
     context: dict = field(default_factory=dict)
+    # 上下文版本号：每次 update_context 递增，resource 据此复用已序列化的结果
+    version: int = 0
+    resource_cache: Dict[str, Tuple[int, str]] = field(default_factory=dict, repr=False)
+    # 最近一次被访问的时间（time()），用于空闲超时淘汰
+    last_access: float = field(default_factory=time)
+    # 同一会话的工作流工具串行执行：步骤校验、执行（含 await）、advance 在锁内完成
+    step_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
 
     def get_current_step(self) -> Optional[Step]:
         if 0 <= self.current_index < len(self.steps):
@@ -62,6 +80,11 @@ class WorkflowSession:
             self.steps[self.current_index].executed = True
             self.current_index += 1
 
+    def update_context(self, **values) -> None:
+        """写入上下文并递增版本号（修改 context 请统一走这里）"""
+        self.context.update(values)
+        self.version += 1
+
     def insert_step(self, step: Step) -> None:
         """在当前位置插入步骤（用于 repeatable）"""
         self.steps.insert(self.current_index, step)
@@ -70,12 +93,13 @@ class WorkflowSession:
         return self.current_index >= len(self.steps)
 
     def get_status(self) -> dict:
+        current = self.get_current_step()
         return {
             "workflow_type": self.workflow_type,
             "current_index": self.current_index,
             "total_steps": len(self.steps),
-            "current_step": self.get_current_step().name if self.get_current_step() else None,
-            "steps": [(s.name, "✓" if s.executed else "○") for s in self.steps],
+            "current_step": current.name if current else None,
+            "steps": [(s.name, s.mark()) for s in self.steps],
         }
 
 
@@ -84,7 +108,9 @@ class WorkflowRegistry:
 
     def __init__(self) -> None:
         self._definitions: Dict[str, WorkflowDefinition] = {}
-        self._sessions: Dict[str, WorkflowSession] = {}
+        # 按最近访问排序；超过 config.MAX_SESSIONS 或空闲超过 config.SESSION_TIMEOUT 时
+        # 淘汰最久未用的会话（连同其索引器）
+        self._sessions: "OrderedDict[str, WorkflowSession]" = OrderedDict()
 
     # ---------- 工作流类型 ----------
     def register(self, definition: WorkflowDefinition) -> None:
@@ -115,6 +141,7 @@ class WorkflowRegistry:
         if not definition:
             raise ValueError(f"未注册工作流类型: {workflow_type}")
 
+        self._evict_expired()
         session_id = f"{session_prefix}_{uuid4().hex}"
         steps = [Step(name=s, step_type=_STEP_CONFIG[s]) for s in definition.steps]
         session = WorkflowSession(
@@ -124,10 +151,23 @@ class WorkflowRegistry:
             context=context or {},
         )
         self._sessions[session_id] = session
+        while len(self._sessions) > config.MAX_SESSIONS:
+            evicted_id, _ = self._sessions.popitem(last=False)
+            logger.info(f"会话数超过上限 {config.MAX_SESSIONS}，淘汰最久未用的会话: {evicted_id}")
         return session
 
     def get_session(self, session_id: str) -> Optional[WorkflowSession]:
-        return self._sessions.get(session_id)
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        now = time()
+        if self._is_expired(session, now):
+            del self._sessions[session_id]
+            logger.info(f"会话空闲超时，已淘汰: {session_id}")
+            return None
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session
 
     def remove_session(self, session_id: str) -> bool:
         if session_id in self._sessions:
@@ -136,8 +176,24 @@ class WorkflowRegistry:
         return False
 
     def list_sessions(self) -> List[WorkflowSession]:
+        self._evict_expired()
         return list(self._sessions.values())
 
+    @staticmethod
+    def _is_expired(session: WorkflowSession, now: float) -> bool:
+        timeout = config.SESSION_TIMEOUT
+        return timeout > 0 and now - session.last_access > timeout
+
+    def _evict_expired(self) -> None:
+        """淘汰空闲超过 config.SESSION_TIMEOUT 秒的会话（按最近访问排序，只需检查队首）"""
+        now = time()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if not self._is_expired(session, now):
+                break
+            del self._sessions[session_id]
+            logger.info(f"会话空闲超时，已淘汰: {session_id}")
+
     def sessions_map(self) -> Dict[str, WorkflowSession]:
         """给 resource/调试用：返回原始 dict 视图（不要在外部修改）"""
         return self._sessions